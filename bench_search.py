@@ -0,0 +1,181 @@
+"""Benchmark snapshot loading, search and result formatting on synthetic sheets
+
+Runs against fake_sheets.FakeWorksheet, so no Google account is needed, and
+prints machine-readable JSON that can be compared between releases:
+
+    python bench_search.py --rows 1000,10000,100000 --output bench.json
+"""
+import gc
+import os
+import sys
+import json
+import time
+import random
+import string
+import logging
+import platform
+import argparse
+import tracemalloc
+
+# Keep the benchmark from touching the bot's real snapshot file
+os.environ.setdefault('SNAPSHOT_CACHE_PATH', os.devnull)
+
+import bot
+from fake_sheets import CATALOGUE_HEADERS, synthetic_values
+
+BENCH_SCHEMA_VERSION = 2
+DEFAULT_ROWS = "1000,10000,100000,500000"
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a sorted list of samples"""
+    if not samples:
+        return None
+    rank = max(0, min(len(samples) - 1, round(pct / 100 * len(samples)) - 1))
+    return samples[rank]
+
+def summarize(durations, peak_memory=None):
+    """Latency percentiles in milliseconds and throughput for a list of durations"""
+    durations = sorted(durations)
+    total = sum(durations)
+    return {
+        "count": len(durations),
+        "p50_ms": round(percentile(durations, 50) * 1000, 4),
+        "p99_ms": round(percentile(durations, 99) * 1000, 4),
+        "mean_ms": round(total / len(durations) * 1000, 4),
+        "throughput_per_s": round(len(durations) / total, 1) if total else None,
+        "peak_memory_bytes": peak_memory,
+    }
+
+def timed(func, inputs):
+    """Call func on each input, returning the per-call durations"""
+    durations = []
+    for item in inputs:
+        start = time.perf_counter()
+        func(item)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def peak_memory_of(func, inputs):
+    """Peak traced memory in bytes while calling func on each input"""
+    tracemalloc.start()
+    try:
+        for item in inputs:
+            func(item)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def retained_memory_of(func):
+    """Bytes still allocated by func's return value once it has returned"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        gc.collect()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+def make_workloads(values, count, rng):
+    """Build the hit-heavy, miss-heavy and short query workloads"""
+    titles = [row[0] for row in values[1:]]
+    hit = []
+    for _ in range(count):
+        words = rng.choice(titles).lower().split()
+        start = rng.randrange(len(words))
+        hit.append(" ".join(words[start:start + rng.randint(1, 2)]))
+
+    miss = [
+        "".join(rng.choice("qxzjvkw") for _ in range(rng.randint(4, 10)))
+        for _ in range(count)
+    ]
+    short = [
+        "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(1, 2)))
+        for _ in range(count)
+    ]
+    return {"hit": hit, "miss": miss, "short": short}
+
+def bench_size(rows, queries, seed, measure_memory):
+    """Benchmark one sheet size and return its results"""
+    values = synthetic_values(rows, seed)
+
+    def load(values):
+        headers, columns = bot.columns_from_values(values)
+        return bot.SheetSnapshot(headers, columns, 0)
+
+    result = {"rows": rows, "columns": len(CATALOGUE_HEADERS)}
+    result["load"] = summarize(
+        timed(load, [values]),
+        peak_memory_of(load, [values]) if measure_memory else None,
+    )
+    if measure_memory:
+        # Regenerate the sheet inside the traced region so the cell strings
+        # the snapshot keeps count towards it, as they do in the bot
+        _, retained = retained_memory_of(lambda: load(synthetic_values(rows, seed)))
+        result["snapshot_memory"] = {
+            "bytes": retained,
+            "bytes_per_100k_rows": round(retained * 100000 / rows) if rows else None,
+        }
+
+    current = load(values)
+    rng = random.Random(seed)
+    result["workloads"] = {}
+    for name, workload in make_workloads(values, queries, rng).items():
+        search = lambda query: bot.find_matches(current, query)
+        matches = [search(query) for query in workload]
+        render = lambda row_ids: bot.format_results(current, row_ids[:bot.SEARCH_RESULT_LIMIT])
+
+        result["workloads"][name] = {
+            "search": summarize(
+                timed(search, workload),
+                peak_memory_of(search, workload) if measure_memory else None,
+            ),
+            "format": summarize(
+                timed(render, matches),
+                peak_memory_of(render, matches) if measure_memory else None,
+            ),
+            "hit_rate": round(sum(1 for row_ids in matches if row_ids) / len(matches), 3),
+        }
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default=DEFAULT_ROWS, help="comma-separated sheet sizes")
+    parser.add_argument("--queries", type=int, default=1000, help="queries per workload")
+    parser.add_argument("--mode", choices=["substring", "ranked"], default=bot.SEARCH_MODE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc passes")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    logging.getLogger(bot.__name__).setLevel(logging.WARNING)
+    bot.SEARCH_MODE = args.mode
+
+    report = {
+        "schema": BENCH_SCHEMA_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "search_mode": args.mode,
+            "ngram_size": bot.NGRAM_SIZE,
+            "result_limit": bot.SEARCH_RESULT_LIMIT,
+            "max_matches": bot.SEARCH_MAX_MATCHES,
+            "queries": args.queries,
+            "seed": args.seed,
+        },
+        "results": [],
+    }
+    for rows in (int(size) for size in args.rows.split(",")):
+        print(f"benchmarking {rows} rows...", file=sys.stderr)
+        report["results"].append(bench_size(rows, args.queries, args.seed, not args.no_memory))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,41 @@
 import os
 import json
+import time
+import asyncio
 import logging
-import gspread
-from fastapi import FastAPI, Request, HTTPException
+import re
+import itertools
+import heapq
+import math
+import random
+import base64
+import hashlib
+import hmac
+import threading
+import sqlite3
+import sys
+import contextvars
+from array import array
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Request, HTTPException, Response
+from fastapi.responses import PlainTextResponse
+from prometheus_client import CONTENT_TYPE_LATEST, Counter as MetricCounter, Gauge, Histogram, generate_latest
 from contextlib import asynccontextmanager
-from telegram import Update
-from telegram.ext import Application, ContextTypes, CommandHandler, MessageHandler, filters
+from bisect import bisect_left, insort
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent, Update
+from telegram.constants import ChatAction, MessageLimit
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.ext import (
+    Application,
+    BaseRateLimiter,
+    CallbackQueryHandler,
+    CommandHandler,
+    ContextTypes,
+    InlineQueryHandler,
+    MessageHandler,
+    filters,
+)
 
 # Configure logging
 logging.basicConfig(
@@ -13,10 +43,708 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger(f"{__name__}.slow_queries")
 
 # Global variables
 application = None
+startup_task = None
+# Whether GET /debug/profile is capturing a profile
+profiling = False
+# Seconds from lifespan startup until the snapshot and the application were up
+startup_seconds = None
+# Why startup gave up, if it did; GET / then reports the process as failed
+startup_error = None
 worksheet = None
+snapshot = None
+refresh_task = None
+sync_watch_task = None
+leader_lock_file = None
+# Sheet rows waiting for a debounced sync as (first_row, last_row), both None
+# when the whole sheet should be re-read, and the task that will sync them
+pending_sync = None
+pending_sync_task = None
+last_sync_request = 0.0
+# When Sheets syncs started failing; the last good snapshot is stale until
+# one succeeds again
+sheets_failing_since = None
+update_queue = None
+update_workers = []
+busy_workers = 0
+recent_update_ids = OrderedDict()
+update_stats = {"received": 0, "duplicates": 0, "rejected": 0, "processed": 0, "failed": 0}
+
+# Seconds between background re-reads of the worksheet
+SHEET_REFRESH_INTERVAL = int(os.getenv('SHEET_REFRESH_INTERVAL', '300'))
+
+# "incremental" skips unchanged sheets and only re-indexes changed rows,
+# "full" re-downloads and rebuilds the snapshot on every refresh
+SHEET_SYNC_MODE = os.getenv('SHEET_SYNC_MODE', 'incremental')
+
+# Push invalidation: shared secret for POST /sheets/webhook (disabled when
+# unset), and how long an edit burst must be quiet before one sync runs, at
+# most SHEET_PUSH_MAX_DELAY seconds after its first edit
+SHEET_PUSH_SECRET = os.getenv('SHEET_PUSH_SECRET', '')
+SHEET_PUSH_DEBOUNCE = float(os.getenv('SHEET_PUSH_DEBOUNCE', '2'))
+SHEET_PUSH_MAX_DELAY = float(os.getenv('SHEET_PUSH_MAX_DELAY', '30'))
+
+# Comma-separated Telegram user ids allowed to run admin commands like /reload
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()}
+
+# Webhook update queue: capacity, worker count and how many recent
+# update_ids are remembered to drop Telegram redeliveries
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', '1000'))
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '8'))
+UPDATE_DEDUP_WINDOW = int(os.getenv('UPDATE_DEDUP_WINDOW', '10000'))
+
+# Maximum number of concurrent blocking gspread calls
+SHEETS_MAX_CONCURRENCY = int(os.getenv('SHEETS_MAX_CONCURRENCY', '2'))
+
+# Google Sheets read quota: reads allowed per rolling minute (the API's
+# default per-user quota is 60), retries of a read failing with 429, 5xx or a
+# network error, and the base and cap in seconds of their jittered backoff
+SHEETS_READS_PER_MINUTE = int(os.getenv('SHEETS_READS_PER_MINUTE', '60'))
+SHEETS_MAX_RETRIES = int(os.getenv('SHEETS_MAX_RETRIES', '4'))
+SHEETS_BACKOFF_BASE = float(os.getenv('SHEETS_BACKOFF_BASE', '1'))
+SHEETS_BACKOFF_MAX = float(os.getenv('SHEETS_BACKOFF_MAX', '32'))
+# Connecting to Telegram at startup: attempts made while it fails with a
+# network error or timeout, and the base and cap in seconds of their backoff
+BOT_INIT_MAX_ATTEMPTS = int(os.getenv('BOT_INIT_MAX_ATTEMPTS', '8'))
+BOT_INIT_BACKOFF_BASE = float(os.getenv('BOT_INIT_BACKOFF_BASE', '1'))
+BOT_INIT_BACKOFF_MAX = float(os.getenv('BOT_INIT_BACKOFF_MAX', '30'))
+
+# Thread pool that keeps gspread's blocking HTTP calls off the event loop
+sheets_executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_CONCURRENCY, thread_name_prefix="sheets")
+
+# Rendered search result cache: maximum entries and seconds an entry lives
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '1024'))
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', '600'))
+
+# Match cursors behind the Next/Prev buttons: total row ids kept across all
+# cursors and seconds a cursor stays usable
+CURSOR_CACHE_MAX_IDS = int(os.getenv('CURSOR_CACHE_MAX_IDS', '200000'))
+CURSOR_CACHE_TTL = int(os.getenv('CURSOR_CACHE_TTL', '1800'))
+
+# Local file the latest snapshot and its index are persisted to, so a cold
+# start can answer before Google Sheets has been read again
+SNAPSHOT_CACHE_PATH = os.getenv('SNAPSHOT_CACHE_PATH', 'sheet_snapshot.db')
+SNAPSHOT_FILE_FORMAT = "7"
+# Separates a row's lowercased cells in the snapshot file; a query can't
+# contain it, so a substring match on the joined cells is a match in one cell
+CELL_SEPARATOR = "\x1f"
+
+# With SHARED_SNAPSHOT=1 several uvicorn workers share the snapshot file: one
+# leader process owns Sheets refreshes and webhook registration and the others
+# search the memory-mapped file, polling it for the leader's updates
+SHARED_SNAPSHOT = os.getenv('SHARED_SNAPSHOT', '0') == '1'
+SHARED_SNAPSHOT_POLL_INTERVAL = float(os.getenv('SHARED_SNAPSHOT_POLL_INTERVAL', '2'))
+SHARED_SNAPSHOT_MMAP_SIZE = int(os.getenv('SHARED_SNAPSHOT_MMAP_SIZE', str(1 << 30)))
+
+# Length of the character n-grams used by the search index
+NGRAM_SIZE = 3
+
+# "substring" returns matches in sheet order, "ranked" returns the most
+# similar rows by trigram similarity and tolerates typos
+SEARCH_MODE = os.getenv('SEARCH_MODE', 'substring')
+# Share of the query's trigrams a row needs to be a ranked result
+SEARCH_MIN_SIMILARITY = float(os.getenv('SEARCH_MIN_SIMILARITY', '0.5'))
+# Number of results shown per page, and most matches a search pages through
+SEARCH_RESULT_LIMIT = 5
+SEARCH_MAX_MATCHES = int(os.getenv('SEARCH_MAX_MATCHES', '100'))
+# Longest display line kept per row; longer rows are cut with an ellipsis so
+# a full page of results fits in one Telegram message, leaving 200 characters
+# for the header and page footer and 8 per line for its number and spacing
+RESULT_LINE_MAX_LENGTH = min(
+    int(os.getenv('RESULT_LINE_MAX_LENGTH', '770')),
+    (MessageLimit.MAX_TEXT_LENGTH - 200) // SEARCH_RESULT_LIMIT - 8,
+)
+
+# Inline mode (@bot <prefix>): comma-separated header names to complete on
+# (default: headers containing "title" or "name", else the first column),
+# results per page and how long Telegram may cache an answer
+INLINE_TITLE_COLUMNS = [name.strip() for name in os.getenv('INLINE_TITLE_COLUMNS', '').split(',') if name.strip()]
+INLINE_PAGE_SIZE = min(int(os.getenv('INLINE_PAGE_SIZE', '20')), 50)
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '300'))
+
+# Bot API endpoint the bot token is appended to; point it at a local stub
+# server for load tests
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL', 'https://api.telegram.org/bot')
+
+# Outbound Bot API connection pool: size, seconds to wait for a free
+# connection, connect/read/write timeouts, and "1.1" or "2" (HTTP/2 needs
+# the httpx[http2] extra)
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '256'))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv('TELEGRAM_POOL_TIMEOUT', '10'))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', '5'))
+TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', '5'))
+TELEGRAM_WRITE_TIMEOUT = float(os.getenv('TELEGRAM_WRITE_TIMEOUT', '5'))
+TELEGRAM_HTTP_VERSION = os.getenv('TELEGRAM_HTTP_VERSION', '1.1')
+
+# Telegram's flood limits: messages per second overall and to one private
+# chat, messages per minute to one group, and how many messages a chat may
+# get in a burst before spacing applies; 0 turns a limit off. A 429 is
+# retried after its retry_after up to TELEGRAM_MAX_RETRIES times, unless
+# the wait is longer than TELEGRAM_MAX_RETRY_AFTER seconds
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))
+TELEGRAM_GROUP_RATE = float(os.getenv('TELEGRAM_GROUP_RATE', '20'))
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '2'))
+TELEGRAM_MAX_RETRY_AFTER = int(os.getenv('TELEGRAM_MAX_RETRY_AFTER', '30'))
+
+# Searches still running after this many seconds show "typing" in the chat,
+# which Telegram displays for TYPING_ACTION_SECONDS
+TYPING_ACTION_DELAY = 0.5
+TYPING_ACTION_SECONDS = 5
+# Chats the send scheduler keeps spacing state for before forgetting idle ones
+SEND_TRACKED_CHATS = 10000
+
+# Share of updates whose stage timings feed monktv_update_stage_seconds, and
+# the update time in seconds (0 turns it off) above which a query is written
+# with its stage breakdown to the slow-query log: SLOW_QUERY_LOG, or the
+# bot's log when unset
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.1'))
+SLOW_QUERY_SECONDS = float(os.getenv('SLOW_QUERY_SECONDS', '1'))
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', '')
+
+# Shared secret enabling GET /debug/profile, and the longest profile it takes
+PROFILE_SECRET = os.getenv('PROFILE_SECRET', '')
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+# Seconds between stack samples of a stack profile
+PROFILE_SAMPLE_INTERVAL = 0.01
+
+# Prometheus metrics, served on /metrics; in-memory stages get finer buckets
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+WEBHOOK_SECONDS = Histogram("monktv_webhook_seconds", "Time to accept a Telegram webhook request", buckets=FAST_BUCKETS)
+UPDATE_SECONDS = Histogram("monktv_update_processing_seconds", "Time to process one queued update")
+SHEET_FETCH_SECONDS = Histogram("monktv_sheet_fetch_seconds", "Google Sheets request latency", ["kind"])
+SEARCH_SECONDS = Histogram("monktv_search_seconds", "Time to find the matching rows for a query", buckets=FAST_BUCKETS)
+FORMAT_SECONDS = Histogram("monktv_format_seconds", "Time to format the result text for a query", buckets=FAST_BUCKETS)
+REPLY_SECONDS = Histogram("monktv_telegram_reply_seconds", "Telegram sendMessage latency")
+UPDATES_TOTAL = MetricCounter("monktv_updates_total", "Queued updates by handler type", ["type"])
+SEARCHES_TOTAL = MetricCounter("monktv_searches_total", "Searches by outcome", ["outcome"])
+RESULT_CACHE_LOOKUPS = MetricCounter("monktv_result_cache_lookups_total", "Result cache lookups", ["result"])
+ERRORS_TOTAL = MetricCounter("monktv_errors_total", "Errors by stage", ["stage"])
+SHEETS_RETRIES = MetricCounter("monktv_sheets_retries_total", "Retried Google Sheets reads by failure", ["reason"])
+SHEETS_BUDGET_WAIT_SECONDS = MetricCounter("monktv_sheets_budget_wait_seconds_total", "Time Sheets reads waited for the per-minute read budget")
+UPDATE_STAGE_SECONDS = Histogram("monktv_update_stage_seconds", "Time sampled updates spent in each stage", ["stage"], buckets=FAST_BUCKETS)
+SLOW_QUERIES = MetricCounter("monktv_slow_queries_total", "Updates slower than SLOW_QUERY_SECONDS")
+SNAPSHOT_ROWS = Gauge("monktv_snapshot_rows", "Rows in the current sheet snapshot")
+SNAPSHOT_AGE = Gauge("monktv_snapshot_age_seconds", "Seconds since the current snapshot was read from Sheets")
+UPDATE_QUEUE_DEPTH = Gauge("monktv_update_queue_depth", "Updates waiting in the queue")
+BUSY_WORKERS = Gauge("monktv_busy_update_workers", "Update workers currently processing an update")
+SNAPSHOT_STALE = Gauge("monktv_snapshot_stale", "1 while Sheets syncs fail and the last good snapshot is served")
+TELEGRAM_SEND_WAIT_SECONDS = MetricCounter("monktv_telegram_send_wait_seconds_total", "Time Telegram sends waited for the flood limits")
+TELEGRAM_FLOOD_WAITS = MetricCounter("monktv_telegram_flood_waits_total", "429 flood-wait answers from Telegram")
+TELEGRAM_DROPPED_ACTIONS = MetricCounter("monktv_telegram_dropped_chat_actions_total", "Redundant typing actions not sent")
+TELEGRAM_PENDING_SENDS = Gauge("monktv_telegram_pending_sends", "Bot API sends being spaced or awaiting Telegram")
+SHEETS_READS = Gauge("monktv_sheets_reads_last_minute", "Google Sheets reads in the last minute")
+
+# Gauges are computed when scraped, so the request path never updates them
+SNAPSHOT_ROWS.set_function(lambda: snapshot.row_count if snapshot else 0)
+SNAPSHOT_AGE.set_function(lambda: snapshot.age() if snapshot else float("nan"))
+UPDATE_QUEUE_DEPTH.set_function(lambda: update_queue.qsize() if update_queue else 0)
+BUSY_WORKERS.set_function(lambda: busy_workers)
+SNAPSHOT_STALE.set_function(lambda: 0 if sheets_failing_since is None else 1)
+SHEETS_READS.set_function(lambda: sheets_reads.recent())
+TELEGRAM_PENDING_SENDS.set_function(lambda: send_scheduler.pending_sends())
+
+# One JSON object per line in the slow-query log file
+if SLOW_QUERY_LOG:
+    slow_query_handler = logging.FileHandler(SLOW_QUERY_LOG)
+    slow_query_handler.setFormatter(logging.Formatter('%(message)s'))
+    slow_query_logger.addHandler(slow_query_handler)
+    slow_query_logger.propagate = False
+
+_snapshot_versions = itertools.count(1)
+
+# Serializes snapshot loads and patches so concurrent syncs can't lose updates
+sync_lock = threading.RLock()
+
+def ngrams(text):
+    """Return the set of NGRAM_SIZE character n-grams in text"""
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+def row_ngrams(cells):
+    """Return the set of n-grams across all cells of a row"""
+    grams = set()
+    for cell in cells:
+        grams |= ngrams(cell)
+    return grams
+
+def normalize_query(query):
+    """Lowercase the query and collapse runs of whitespace"""
+    return ' '.join(query.split()).lower()
+
+# "column:value" searches one column for a substring, "column=value" looks up
+# rows whose cell in that column equals value
+SCOPED_QUERY = re.compile(r"^\s*([^:=]+?)\s*([:=])\s*(.*)$")
+
+def parse_scoped_query(query, column_ids):
+    """Return (column index, operator, value) for a scoped query, else None
+
+    Only a prefix naming a sheet header counts as a scope, so queries that
+    merely contain ":" or "=" (like links) keep searching every column.
+    """
+    match = SCOPED_QUERY.match(query)
+    if not match:
+        return None
+    column = column_ids.get(normalize_query(match.group(1)))
+    if column is None:
+        return None
+    return column, match.group(2), normalize_query(match.group(3))
+
+def title_columns(headers):
+    """Return the indexes of the columns the inline prefix index covers"""
+    if INLINE_TITLE_COLUMNS:
+        return [column for column, header in enumerate(headers) if header in INLINE_TITLE_COLUMNS]
+    titles = [column for column, header in enumerate(headers) if "title" in header.lower() or "name" in header.lower()]
+    if titles or not headers:
+        return titles
+    return [0]
+
+def prefix_entries(cells, row_id):
+    """Return the set of (text, row id) prefix index entries for every word start of a row's title cells
+
+    A set, since title cells often share words, like "Avengers Endgame" and
+    "Endgame", and each entry may only be stored once.
+    """
+    entries = set()
+    for cell in cells:
+        text = normalize_query(cell)
+        if text:
+            entries.add((text, row_id))
+            entries.update((text[i + 1:], row_id) for i, char in enumerate(text) if char == " ")
+    return entries
+
+# Characters that would break a result's one-line layout in a plain text message
+CONTROL_CHARS = re.compile(r"[\x00-\x1f\x7f]")
+
+def display_value(value):
+    """Return a cell value as single-line text safe to send in a plain Telegram message"""
+    return " ".join(CONTROL_CHARS.sub(" ", str(value)).split())
+
+def render_line(headers, row):
+    """Return a row's display line, its non-empty fields as "header: value | header: value" """
+    fields = ((header, display_value(value)) for header, value in zip(headers, row) if value)
+    line = " | ".join(f"{header}: {text}" for header, text in fields if text)
+    if len(line) > RESULT_LINE_MAX_LENGTH:
+        line = line[:RESULT_LINE_MAX_LENGTH - 1] + "…"
+    return line
+
+def compact_column(values):
+    """Return a column's values and their lowercased copies, sharing equal strings
+
+    Sheets repeat values a lot (genres, languages, qualities) and many cells
+    (links, codes) are lowercase already, so one pool per column stores each
+    distinct string once for both copies.
+    """
+    pool = {}
+    column = []
+    folded = []
+    for value in values:
+        if isinstance(value, str):
+            value = pool.setdefault(value, value)
+        text = str(value).lower()
+        column.append(value)
+        folded.append(pool.setdefault(text, text))
+    return column, folded
+
+class SheetSnapshot:
+    """Read-only in-memory copy of the worksheet with a search index
+
+    Cells are stored column by column and rows are referenced by their
+    integer id, the row's position below the header row.
+    """
+
+    def __init__(
+        self,
+        headers,
+        columns,
+        version,
+        folded=None,
+        lines=None,
+        index=None,
+        gram_counts=None,
+        prefixes=None,
+        exact=None,
+        loaded_at=None,
+        modified_time=None,
+        generation=None,
+    ):
+        self.headers = [sys.intern(header) for header in headers]
+        self.column_ids = {normalize_query(header): column for column, header in enumerate(self.headers)}
+        self.title_ids = title_columns(self.headers)
+        self.version = version
+        self.loaded_at = loaded_at or time.time()
+        # Drive modifiedTime of the spreadsheet this snapshot was read at
+        self.modified_time = modified_time
+        # Unlike version, which counts per process, the generation is saved
+        # in the snapshot file, so every worker names this snapshot alike
+        self.generation = generation or str(time.time_ns())
+        
+        # One list of values per column, plus lowercased copies computed
+        # once instead of per query
+        if folded is None:
+            compacted = [compact_column(column) for column in columns]
+            columns = [column for column, _ in compacted]
+            folded = [cells for _, cells in compacted]
+        self.columns = columns
+        self.folded = folded
+        self.row_count = len(columns[0]) if columns else 0
+        
+        # Each row's display line, escaped and truncated once here so a
+        # reply is a single join over the matching rows
+        if lines is None:
+            lines = [render_line(self.headers, self.row(row_id)) for row_id in range(self.row_count)]
+        self.lines = lines
+        
+        # Inverted index: n-gram -> sorted array of the ids of the rows
+        # containing it in any cell, plus the number of distinct n-grams per
+        # row for ranking
+        self.index = index
+        self.gram_counts = gram_counts
+        if index is None or gram_counts is None:
+            building = {}
+            self.gram_counts = array('I')
+            for row_id in range(self.row_count):
+                grams = row_ngrams(self.cells(row_id))
+                self.gram_counts.append(len(grams))
+                if index is None:
+                    for gram in grams:
+                        postings = building.get(gram)
+                        if postings is None:
+                            building[gram] = [row_id]
+                        else:
+                            postings.append(row_id)
+            if index is None:
+                self.index = {gram: array('I', row_ids) for gram, row_ids in building.items()}
+        
+        # Sorted (title suffix, row id) entries for inline prefix completion
+        if prefixes is None:
+            prefixes = sorted(
+                entry for row_id in range(self.row_count)
+                for entry in prefix_entries(self.title_cells(row_id), row_id)
+            )
+        self.prefixes = prefixes
+        
+        # Per-column hash indexes: normalized cell -> sorted ids of its rows
+        if exact is None:
+            exact = []
+            for cells in self.folded:
+                column_index = {}
+                for row_id, cell in enumerate(cells):
+                    value = normalize_query(cell)
+                    column_index.setdefault(cell if value == cell else value, []).append(row_id)
+                exact.append(column_index)
+        self.exact = exact
+
+    def row(self, row_id):
+        """Return the values of one row, in header order"""
+        return [column[row_id] for column in self.columns]
+
+    def cells(self, row_id):
+        """Return the lowercased cells of one row, in header order"""
+        return [column[row_id] for column in self.folded]
+
+    def display_lines(self, row_ids):
+        """Return the pre-rendered display lines of the given rows"""
+        lines = self.lines
+        return [lines[row_id] for row_id in row_ids]
+
+    def title_cells(self, row_id):
+        """Return the lowercased cells of one row's title columns"""
+        return [self.folded[column][row_id] for column in self.title_ids]
+
+    def age(self):
+        """Seconds since this snapshot was read from Google Sheets"""
+        return time.time() - self.loaded_at
+
+    def patched(self, changes, row_count, version, modified_time):
+        """Return a copy with changes applied and the n-grams whose postings changed
+
+        changes maps row id -> new row values and must cover every row id from
+        the current row count up to row_count; rows from row_count on are
+        dropped. This snapshot is left untouched and unchanged postings are
+        shared.
+        """
+        growth = max(0, row_count - self.row_count)
+        columns = [column[:row_count] + [""] * growth for column in self.columns]
+        folded = [column[:row_count] + [""] * growth for column in self.folded]
+        lines = self.lines[:row_count] + [""] * growth
+        gram_counts = self.gram_counts[:row_count] + array('I', [0]) * growth
+        index = dict(self.index)
+        touched = {}
+        
+        def postings(gram):
+            # Turn a posting into a set the first time this patch modifies it
+            if gram not in touched:
+                touched[gram] = set(index.get(gram, ()))
+            return touched[gram]
+        
+        for row_id in itertools.chain(range(row_count, self.row_count), changes):
+            if row_id < self.row_count:
+                for gram in row_ngrams(self.cells(row_id)):
+                    postings(gram).discard(row_id)
+        
+        for row_id, values in changes.items():
+            lines[row_id] = render_line(self.headers, values)
+            grams = set()
+            for column, value in enumerate(values):
+                columns[column][row_id] = value
+                folded[column][row_id] = str(value).lower()
+                grams |= ngrams(folded[column][row_id])
+            gram_counts[row_id] = len(grams)
+            for gram in grams:
+                postings(gram).add(row_id)
+        
+        for gram, row_ids in touched.items():
+            if row_ids:
+                index[gram] = array('I', sorted(row_ids))
+            else:
+                index.pop(gram, None)
+        
+        # Drop the prefix entries of changed and removed rows, then merge in
+        # the new ones; sorting nearly sorted data is close to linear
+        affected = set(changes).union(range(row_count, self.row_count))
+        prefixes = [entry for entry in self.prefixes if entry[1] not in affected]
+        for row_id in changes:
+            prefixes.extend(prefix_entries([folded[column][row_id] for column in self.title_ids], row_id))
+        prefixes.sort()
+        
+        # Copy each column index and row id list the first time it changes
+        exact = [dict(column_index) for column_index in self.exact]
+        copied = set()
+        
+        def exact_rows(column, value):
+            if (column, value) not in copied:
+                copied.add((column, value))
+                exact[column][value] = list(exact[column].get(value, ()))
+            return exact[column][value]
+        
+        for row_id in sorted(affected):
+            if row_id < self.row_count:
+                for column, cell in enumerate(self.cells(row_id)):
+                    value = normalize_query(cell)
+                    exact_rows(column, value).remove(row_id)
+                    if not exact[column][value]:
+                        del exact[column][value]
+                        copied.discard((column, value))
+            if row_id < row_count:
+                for column in range(len(exact)):
+                    insort(exact_rows(column, normalize_query(folded[column][row_id])), row_id)
+        
+        patched = SheetSnapshot(
+            self.headers,
+            columns,
+            version,
+            folded=folded,
+            lines=lines,
+            index=index,
+            gram_counts=gram_counts,
+            prefixes=prefixes,
+            exact=exact,
+            modified_time=modified_time,
+        )
+        return patched, set(touched)
+
+    def find(self, query, limit=None, column=None):
+        """Return ids of rows with a cell containing query, in sheet order
+
+        With a limit, stops after that many matches. With a column index,
+        only that column's cells are checked.
+        """
+        needle = query.lower()
+        grams = ngrams(needle)
+        
+        if grams:
+            # Intersect postings smallest first, then verify the remaining
+            # candidates since grams may come from different cells. Checking
+            # a few candidates is cheaper than walking a much longer posting.
+            postings = sorted((self.index.get(gram, ()) for gram in grams), key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                if not candidates or len(posting) > 32 * len(candidates):
+                    break
+                candidates.intersection_update(posting)
+            candidates = sorted(candidates)
+        else:
+            # Queries shorter than an n-gram can't use the index
+            candidates = range(self.row_count)
+        
+        if column is None:
+            folded = self.folded
+            matches = (
+                row_id for row_id in candidates
+                if any(needle in cells[row_id] for cells in folded)
+            )
+        else:
+            cells = self.folded[column]
+            matches = (row_id for row_id in candidates if needle in cells[row_id])
+        return list(itertools.islice(matches, limit))
+
+    def find_exact(self, column, value, limit=None):
+        """Return ids of rows whose cell in column equals the normalized value"""
+        return self.exact[column].get(value, [])[:limit]
+
+    def rank(self, query, limit):
+        """Return ids of up to limit rows most similar to query, best first
+
+        Rows are scored by trigram Jaccard similarity with the query. Only rows
+        sharing at least SEARCH_MIN_SIMILARITY of the query's trigrams are
+        considered, and a bounded heap picks the best without sorting them all.
+        """
+        grams = ngrams(query.lower())
+        if not grams:
+            # Too short to compare trigrams, fall back to substring matches
+            return self.find(query, limit)
+        
+        wanted = max(1, math.ceil(len(grams) * SEARCH_MIN_SIMILARITY))
+        matched = count_shared_grams([self.index.get(gram, ()) for gram in grams], wanted)
+        gram_counts = self.gram_counts
+        best = heapq.nlargest(limit, (
+            (shared / (len(grams) + gram_counts[row_id] - shared), -row_id)
+            for row_id, shared in matched.items() if shared >= wanted
+        ))
+        return [-row_id for _, row_id in best]
+
+    def complete(self, prefix, offset, limit):
+        """Return up to limit ids of rows with a title word starting with prefix
+
+        Rows are ordered by the matching title text and the first offset of
+        them are skipped. Also returns whether more rows follow.
+        """
+        rows = distinct_rows(
+            itertools.takewhile(
+                lambda entry: entry[0].startswith(prefix),
+                itertools.islice(self.prefixes, bisect_left(self.prefixes, (prefix,)), None),
+            )
+        )
+        page = list(itertools.islice(rows, offset, offset + limit + 1))
+        return page[:limit], len(page) > limit
+
+def count_shared_grams(postings, wanted):
+    """Return a Counter of row id -> number of postings holding it
+
+    Only rows in at least wanted postings are counted exactly; others may be
+    missing. Such a row is in one of the len(postings) - wanted + 1 shortest
+    postings, so only those are walked to pick candidates. The longer ones
+    are then bisected per candidate, unless walking them is cheaper.
+    """
+    postings = sorted(postings, key=len)
+    split = len(postings) - wanted + 1
+    matched = Counter()
+    for posting in postings[:split]:
+        matched.update(posting)
+    
+    longer = postings[split:]
+    if 6 * len(matched) * len(longer) >= sum(map(len, longer)):
+        for posting in longer:
+            matched.update(posting)
+        return matched
+    
+    candidates = list(matched)
+    for probed, posting in enumerate(longer):
+        if probed:
+            # Drop the candidates that can't reach wanted even in every posting left
+            left = len(longer) - probed
+            candidates = [row_id for row_id in candidates if matched[row_id] + left >= wanted]
+        size = len(posting)
+        matched.update(
+            row_id for row_id in candidates
+            if (position := bisect_left(posting, row_id)) < size and posting[position] == row_id
+        )
+    return matched
+
+def distinct_rows(entries):
+    """Yield the row id of each (text, row id) entry the first time it appears"""
+    seen = set()
+    for _, row_id in entries:
+        if row_id not in seen:
+            seen.add(row_id)
+            yield row_id
+
+def jittered_backoff(attempt, cap, base=None):
+    """Return a delay in [d/2, d] for d = base * 2**attempt capped at cap, base defaulting to SHEETS_BACKOFF_BASE"""
+    delay = min(cap, (SHEETS_BACKOFF_BASE if base is None else base) * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def retry_reason(error):
+    """Return why a failed Sheets read is worth retrying, or None if it isn't"""
+    from gspread.exceptions import APIError
+    from requests.exceptions import RequestException
+    
+    if isinstance(error, APIError):
+        status = getattr(error.response, "status_code", None)
+        if status == 429 or (status is not None and status >= 500):
+            return str(status)
+        return None
+    if isinstance(error, RequestException):
+        return "network"
+    return None
+
+class ReadBudget:
+    """Paces Google Sheets reads to a per-minute quota and retries transient failures
+
+    Every read, retries included, takes a slot in a rolling one-minute
+    window. A read that finds the window full waits for the oldest slot to
+    expire rather than spending quota Google would refuse with a 429.
+    """
+
+    def __init__(self, per_minute, max_retries):
+        self.per_minute = per_minute
+        self.max_retries = max_retries
+        self.reads = deque()
+        self.lock = threading.Lock()
+
+    def recent(self):
+        """Number of reads made in the last minute"""
+        with self.lock:
+            self._expire(time.monotonic())
+            return len(self.reads)
+
+    def _expire(self, now):
+        while self.reads and self.reads[0] <= now - 60:
+            self.reads.popleft()
+
+    def acquire(self):
+        """Block until a read fits in the budget, then record it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._expire(now)
+                if len(self.reads) < self.per_minute:
+                    self.reads.append(now)
+                    return
+                wait = self.reads[0] + 60 - now
+            SHEETS_BUDGET_WAIT_SECONDS.inc(wait)
+            time.sleep(wait)
+
+    def call(self, kind, func, *args):
+        """Run one Sheets read within the budget, retrying 429, 5xx and network errors"""
+        for attempt in itertools.count():
+            self.acquire()
+            try:
+                with SHEET_FETCH_SECONDS.labels(kind).time():
+                    return func(*args)
+            except Exception as e:
+                reason = retry_reason(e)
+                if reason is None or attempt >= self.max_retries:
+                    raise
+                
+                # Honour Retry-After on a 429 unless it exceeds the backoff cap,
+                # in which case the periodic refresh retries later instead
+                delay = jittered_backoff(attempt, SHEETS_BACKOFF_MAX)
+                retry_after = getattr(getattr(e, "response", None), "headers", {}).get("Retry-After", "")
+                if retry_after.isdigit():
+                    if int(retry_after) > SHEETS_BACKOFF_MAX:
+                        raise
+                    delay = max(delay, int(retry_after))
+                
+                SHEETS_RETRIES.labels(reason).inc()
+                logger.warning(f"⚠️ Sheets {kind} read failed ({reason}), retry {attempt + 1} in {delay:.1f}s")
+                time.sleep(delay)
+
+sheets_reads = ReadBudget(SHEETS_READS_PER_MINUTE, SHEETS_MAX_RETRIES)
 
 def load_environment_variables():
     """Load and validate environment variables"""
@@ -35,6 +763,11 @@ def load_environment_variables():
 def setup_google_sheets():
     """Setup Google Sheets connection"""
     global worksheet
+    # gspread and google-auth take a noticeable share of startup to import,
+    # so they load here, off the event loop, and only in the process that
+    # talks to Sheets
+    import gspread
+    
     try:
         # Parse Google credentials
         google_creds_json = os.getenv('GOOGLE_CREDS_JSON')
@@ -65,7 +798,7 @@ def setup_google_sheets():
         # Try to open the spreadsheet
         sheet_name = "sheet1"
         try:
-            spreadsheet = gc.open(sheet_name)
+            spreadsheet = sheets_reads.call("open", gc.open, sheet_name)
             logger.info(f"✅ Spreadsheet '{sheet_name}' opened successfully")
         except gspread.SpreadsheetNotFound:
             logger.error(f"❌ Spreadsheet '{sheet_name}' not found")
@@ -82,12 +815,13 @@ def setup_google_sheets():
         
         # Get the first worksheet
         try:
-            worksheet = spreadsheet.sheet1
+            worksheet = sheets_reads.call("open", lambda: spreadsheet.sheet1)
             logger.info("✅ Worksheet accessed successfully")
             
-            # Test reading from the sheet
-            test_data = worksheet.get_all_records(limit=1)
-            logger.info(f"✅ Sheet test read successful. Sample data: {test_data}")
+            # Test reading from the sheet; the header row is enough, the
+            # records themselves are read by load_snapshot()
+            headers = sheets_reads.call("header", worksheet.row_values, 1)
+            logger.info(f"✅ Sheet test read successful. Headers: {headers}")
             
         except Exception as e:
             logger.error(f"❌ Error accessing worksheet: {e}")
@@ -98,42 +832,1130 @@ def setup_google_sheets():
         
     except Exception as e:
         logger.error(f"❌ Google Sheets setup failed: {e}")
+        ERRORS_TOTAL.labels("sheets_setup").inc()
+        return False
+
+def row_from_values(headers, row):
+    """Pad one row of raw cell values to the header width, converting numbers like get_all_records() does"""
+    from gspread.utils import numericise_all
+    
+    row = row + [""] * (len(headers) - len(row))
+    return numericise_all(row)
+
+def columns_from_values(values):
+    """Split raw worksheet values into the header row and one list of values per column"""
+    from gspread.exceptions import GSpreadException
+    from gspread.utils import numericise_all
+    
+    if not values:
+        return [], []
+    
+    width = max(len(row) for row in values)
+    headers = values[0] + [""] * (width - len(values[0]))
+    if len(set(headers)) != len(headers):
+        raise GSpreadException("the header row in the worksheet is not unique")
+    
+    rows = values[1:]
+    return headers, [
+        numericise_all([row[column] if column < len(row) else "" for row in rows])
+        for column in range(width)
+    ]
+
+def load_snapshot():
+    """Read the whole worksheet and swap it in as the current snapshot"""
+    global snapshot
+    with sync_lock:
+        try:
+            if not worksheet:
+                raise ValueError("Google Sheets not connected")
+            
+            modified_time = sheets_reads.call("check", worksheet.spreadsheet.get_lastUpdateTime)
+            values = sheets_reads.call("full", worksheet.get_all_values)
+            headers, columns = columns_from_values(values)
+            del values
+            return publish_snapshot(headers, columns, modified_time)
+            
+        except Exception as e:
+            logger.error(f"❌ Sheet snapshot load failed: {e}")
+            ERRORS_TOTAL.labels("snapshot_load").inc()
+            return False
+
+def publish_snapshot(headers, columns, modified_time):
+    """Build a snapshot from the whole worksheet's cells, swap it in and save it"""
+    global snapshot
+    # Build the new snapshot completely before publishing it, so searches
+    # only ever see a fully loaded version
+    new_snapshot = SheetSnapshot(headers, columns, next(_snapshot_versions), modified_time=modified_time)
+    snapshot = new_snapshot
+    
+    logger.info(f"✅ Sheet snapshot v{new_snapshot.version} loaded ({new_snapshot.row_count} rows)")
+    
+    # Keep a local copy for the next cold start
+    save_snapshot_file(new_snapshot)
+    return True
+
+def sync_snapshot(first_row=None, last_row=None, force=False):
+    """Bring the snapshot up to date, fetching and re-indexing only what changed
+
+    With a range of 1-based sheet rows only those rows are fetched. Otherwise
+    the spreadsheet's Drive modifiedTime decides whether to fetch at all,
+    unless force is set, and a changed sheet is diffed against the snapshot
+    row by row.
+    """
+    global snapshot
+    with sync_lock:
+        current = snapshot
+        if (
+            SHEET_SYNC_MODE != "incremental"
+            or not isinstance(current, SheetSnapshot)
+            or (first_row is not None and first_row <= 1)
+        ):
+            return load_snapshot()
+        
+        try:
+            if not worksheet:
+                raise ValueError("Google Sheets not connected")
+            
+            if first_row is None:
+                modified_time = sheets_reads.call("check", worksheet.spreadsheet.get_lastUpdateTime)
+                if modified_time == current.modified_time and not force:
+                    logger.info(f"✅ Sheet unchanged since snapshot v{current.version}, skipping fetch")
+                    return True
+                
+                values = sheets_reads.call("full", worksheet.get_all_values)
+                headers, columns = columns_from_values(values)
+                del values
+                # The whole sheet is already here, so rebuild from it
+                # rather than reading it again
+                if headers != current.headers:
+                    return publish_snapshot(headers, columns, modified_time)
+                
+                row_count = len(columns[0]) if columns else 0
+                changes = {
+                    row_id: row for row_id, row in enumerate(map(list, zip(*columns)))
+                    if row_id >= current.row_count or row != current.row(row_id)
+                }
+            else:
+                # Only a full diff may advance modified_time: edits outside
+                # the range, inserted or deleted rows and lost notifications
+                # must still show up as a change on the next refresh
+                modified_time = current.modified_time
+                values = sheets_reads.call("range", worksheet.get_values, f"{first_row}:{last_row}")
+                if any(len(row) > len(current.headers) for row in values):
+                    return load_snapshot()
+                values += [[]] * (last_row - first_row + 1 - len(values))
+                
+                changes = {
+                    first_row - 2 + offset: row_from_values(current.headers, row)
+                    for offset, row in enumerate(values)
+                }
+                # Rows past the end only count once they hold something;
+                # rows between the old end and the range are blank. A range
+                # reaching the end also drops the blank rows it leaves
+                # there, as a full read of the sheet would
+                filled = [row_id for row_id, row in changes.items() if any(value != "" for value in row)]
+                if first_row - 2 + len(values) < current.row_count:
+                    row_count = current.row_count
+                elif filled:
+                    row_count = max(filled) + 1
+                else:
+                    row_count = min(first_row - 2, current.row_count)
+                    while row_count and all(value == "" for value in current.row(row_count - 1)):
+                        row_count -= 1
+                changes = {row_id: row for row_id, row in changes.items() if row_id < row_count}
+                for row_id in range(current.row_count, row_count):
+                    changes.setdefault(row_id, row_from_values(current.headers, []))
+            
+            # Rebuilding from scratch is cheaper when most rows changed
+            if len(changes) > current.row_count // 2:
+                if first_row is None:
+                    return publish_snapshot(headers, columns, modified_time)
+                return load_snapshot()
+            
+            new_snapshot, touched = current.patched(changes, row_count, next(_snapshot_versions), modified_time)
+            snapshot = new_snapshot
+            
+            logger.info(f"✅ Sheet snapshot v{new_snapshot.version} patched ({len(changes)} changed rows, {new_snapshot.row_count} rows)")
+            
+            update_snapshot_file(new_snapshot, changes, touched, current.generation)
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Sheet snapshot sync failed: {e}")
+            ERRORS_TOTAL.labels("snapshot_sync").inc()
+            return False
+
+async def run_sheets_io(func, *args):
+    """Run a blocking gspread call on the bounded Sheets thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(sheets_executor, func, *args)
+
+async def refresh_snapshot(first_row=None, last_row=None, force=False):
+    """Sync the snapshot from Google Sheets, connecting first if needed
+
+    A failed sync keeps serving the last good snapshot, reported as stale
+    until a sync succeeds again.
+    """
+    global sheets_failing_since
+    # After a cold start from the snapshot file, or a failed startup, Sheets
+    # is connected here
+    synced = bool(worksheet) or await run_sheets_io(setup_google_sheets)
+    if synced:
+        synced = await run_sheets_io(sync_snapshot, first_row, last_row, force)
+    
+    if synced:
+        if sheets_failing_since is not None:
+            logger.info(f"✅ Google Sheets recovered after {time.time() - sheets_failing_since:.0f}s")
+        sheets_failing_since = None
+    elif sheets_failing_since is None:
+        sheets_failing_since = time.time()
+    return synced
+
+async def refresh_snapshot_periodically(delay=SHEET_REFRESH_INTERVAL):
+    """Re-read the worksheet after delay, then every SHEET_REFRESH_INTERVAL seconds
+
+    While Sheets is failing, retries come sooner, backing off exponentially
+    up to the refresh interval.
+    """
+    failures = 0
+    while True:
+        await asyncio.sleep(delay)
+        if await refresh_snapshot():
+            failures = 0
+            delay = SHEET_REFRESH_INTERVAL
+        else:
+            delay = jittered_backoff(failures, SHEET_REFRESH_INTERVAL)
+            failures += 1
+
+class ResultCache:
+    """Thread-safe LRU cache with a size bound and per-entry TTL
+
+    The size is the number of entries unless weigh is given, in which case
+    it is the sum of weigh(value) over all entries.
+    """
+
+    def __init__(self, max_size, ttl, weigh=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.weigh = weigh or (lambda value: 1)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                    self.size -= entry[2]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Store value under key, evicting the least recently used entries"""
+        if self.max_size <= 0:
+            return
+        weight = self.weigh(value)
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[2]
+            self.entries[key] = (time.monotonic() + self.ttl, value, weight)
+            self.size += weight
+            while self.size > self.max_size and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted[2]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+
+# The matching row ids of one search, valid only for the snapshot
+# generation they were found in
+Cursor = namedtuple("Cursor", ["generation", "query", "row_ids"])
+cursor_cache = ResultCache(CURSOR_CACHE_MAX_IDS, CURSOR_CACHE_TTL, weigh=lambda cursor: max(1, len(cursor.row_ids)))
+
+def cursor_token(generation, normalized):
+    """Return a short callback-data-safe token for a search in one snapshot generation"""
+    digest = hashlib.blake2b(f"{generation}:{normalized}".encode(), digest_size=6).digest()
+    return base64.urlsafe_b64encode(digest).decode()
+
+def search_cursor(current, query):
+    """Return the token and cursor of query's matches, searching only on a cache miss"""
+    # Cursors belong to one snapshot generation, so a refresh invalidates
+    # them without an explicit purge, and all workers agree on the token
+    normalized = normalize_query(query)
+    token = cursor_token(current.generation, normalized)
+    cursor = cursor_cache.get(token)
+    if cursor is None:
+        with SEARCH_SECONDS.time():
+            row_ids = find_matches(current, normalized)
+        cursor = Cursor(current.generation, query, array('I', row_ids))
+        cursor_cache.put(token, cursor)
+    return token, cursor
+
+def find_matches(current, query):
+    """Return the ids of the rows to page through for query in the configured search mode"""
+    scoped = parse_scoped_query(query, current.column_ids)
+    if scoped:
+        column, operator, value = scoped
+        if not value:
+            # "title:" alone would match every row
+            return []
+        if operator == "=":
+            return current.find_exact(column, value, SEARCH_MAX_MATCHES)
+        return current.find(value, SEARCH_MAX_MATCHES, column=column)
+    
+    if SEARCH_MODE == "ranked":
+        return current.rank(query, SEARCH_MAX_MATCHES)
+    # Filter records that match the query in any field
+    return current.find(query, SEARCH_MAX_MATCHES)
+
+def format_results(current, row_ids, start=1):
+    """Return the numbered result lines for the given rows, numbered from start"""
+    return "".join(f"{i}. {line}\n\n" for i, line in enumerate(current.display_lines(row_ids), start))
+
+def split_message(text, limit=MessageLimit.MAX_TEXT_LENGTH):
+    """Split text into chunks Telegram accepts, breaking between results where possible"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+# The first line of a result page, from which a page's query is recovered
+RESULTS_HEADER = re.compile(r"🔍 Search Results for '(.*?)':\n", re.DOTALL)
+
+def render_page(current, token, cursor, page, query):
+    """Return the reply text and Next/Prev keyboard for one page of a cursor"""
+    pages = max(1, math.ceil(len(cursor.row_ids) / SEARCH_RESULT_LIMIT))
+    page = min(max(page, 0), pages - 1)
+    
+    # Rendered pages are cached per cursor, whose token includes the version
+    results = result_cache.get((token, page))
+    RESULT_CACHE_LOOKUPS.labels("miss" if results is None else "hit").inc()
+    if results is None:
+        start = page * SEARCH_RESULT_LIMIT
+        with FORMAT_SECONDS.time():
+            results = format_results(current, cursor.row_ids[start:start + SEARCH_RESULT_LIMIT], start + 1)
+        result_cache.put((token, page), results)
+    
+    text = f"🔍 Search Results for '{query}':\n\n" + results
+    if pages == 1:
+        return text, None
+    
+    more = "+" if len(cursor.row_ids) >= SEARCH_MAX_MATCHES else ""
+    text += f"📄 Page {page + 1}/{pages} ({len(cursor.row_ids)}{more} results)"
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"page:{token}:{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"page:{token}:{page + 1}"))
+    return text, InlineKeyboardMarkup([buttons])
+
+def snapshot_settings(headers):
+    """Return the settings a snapshot's display lines and prefixes depend on, as text
+
+    Saved in the snapshot file's meta table; a file saved with other settings
+    is rebuilt rather than served with stale lines or title columns.
+    """
+    return json.dumps({"line_max_length": RESULT_LINE_MAX_LENGTH, "title_columns": title_columns(headers)})
+
+def record_file_row(current, row_id):
+    """Return the snapshot file's records table row for one snapshot row"""
+    return (
+        row_id,
+        json.dumps(current.row(row_id), ensure_ascii=False),
+        CELL_SEPARATOR.join(current.cells(row_id)),
+        current.gram_counts[row_id],
+        current.lines[row_id],
+    )
+
+def save_snapshot_file(current, path=None):
+    """Persist a snapshot and its index to a SQLite file, replacing it atomically"""
+    path = path or SNAPSHOT_CACHE_PATH
+    tmp_path = f"{path}.tmp"
+    try:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("CREATE TABLE records (row_id INTEGER PRIMARY KEY, data TEXT, cells TEXT, gram_count INTEGER, line TEXT)")
+            conn.execute("CREATE TABLE postings (gram TEXT PRIMARY KEY, row_ids BLOB)")
+            conn.execute("CREATE TABLE prefixes (text TEXT, row_id INTEGER, PRIMARY KEY (text, row_id))")
+            conn.execute("CREATE TABLE column_values (col INTEGER, value TEXT, row_id INTEGER, PRIMARY KEY (col, value, row_id)) WITHOUT ROWID")
+            conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ("format", SNAPSHOT_FILE_FORMAT),
+                ("headers", json.dumps(current.headers, ensure_ascii=False)),
+                ("loaded_at", repr(current.loaded_at)),
+                ("modified_time", current.modified_time),
+                ("row_count", str(current.row_count)),
+                ("generation", current.generation),
+                ("settings", snapshot_settings(current.headers)),
+            ])
+            conn.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?)", (
+                record_file_row(current, row_id) for row_id in range(current.row_count)
+            ))
+            conn.executemany("INSERT INTO postings VALUES (?, ?)", (
+                (gram, row_ids.tobytes()) for gram, row_ids in current.index.items()
+            ))
+            conn.executemany("INSERT INTO prefixes VALUES (?, ?)", current.prefixes)
+            conn.executemany("INSERT INTO column_values VALUES (?, ?, ?)", (
+                (column, value, row_id)
+                for column, column_index in enumerate(current.exact)
+                for value, row_ids in column_index.items()
+                for row_id in row_ids
+            ))
+            conn.commit()
+        finally:
+            conn.close()
+        
+        os.replace(tmp_path, path)
+        logger.info(f"💾 Sheet snapshot saved to {path}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Sheet snapshot save failed: {e}")
+        ERRORS_TOTAL.labels("snapshot_file").inc()
+        return False
+
+def update_snapshot_file(current, changes, touched, base_generation, path=None):
+    """Apply a patched snapshot's changed rows and postings to the SQLite file
+
+    The file must hold base_generation, the snapshot that was patched;
+    otherwise, as after a failed save, it is saved in full instead.
+    """
+    path = path or SNAPSHOT_CACHE_PATH
+    if not os.path.exists(path):
+        return save_snapshot_file(current, path)
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            generation = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+            if generation is None or generation[0] != base_generation:
+                logger.warning(f"⚠️ Snapshot file {path} does not hold the patched snapshot, saving it in full")
+                return save_snapshot_file(current, path)
+            
+            # One transaction, so a crash leaves the previous version intact
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)", (
+                    record_file_row(current, row_id) for row_id in changes
+                ))
+                conn.execute("DELETE FROM records WHERE row_id >= ?", (current.row_count,))
+                conn.execute("DELETE FROM prefixes WHERE row_id >= ?", (current.row_count,))
+                conn.execute("DELETE FROM column_values WHERE row_id >= ?", (current.row_count,))
+                conn.executemany("DELETE FROM column_values WHERE row_id = ?", ((row_id,) for row_id in changes))
+                conn.executemany("INSERT INTO column_values VALUES (?, ?, ?)", (
+                    (column, normalize_query(cell), row_id)
+                    for row_id in changes
+                    for column, cell in enumerate(current.cells(row_id))
+                ))
+                conn.executemany("DELETE FROM prefixes WHERE row_id = ?", ((row_id,) for row_id in changes))
+                conn.executemany("INSERT INTO prefixes VALUES (?, ?)", (
+                    entry for row_id in changes
+                    for entry in prefix_entries(current.title_cells(row_id), row_id)
+                ))
+                conn.executemany("DELETE FROM postings WHERE gram = ?", (
+                    (gram,) for gram in touched if gram not in current.index
+                ))
+                conn.executemany("INSERT OR REPLACE INTO postings VALUES (?, ?)", (
+                    (gram, current.index[gram].tobytes())
+                    for gram in touched if gram in current.index
+                ))
+                conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+                    ("loaded_at", repr(current.loaded_at)),
+                    ("modified_time", current.modified_time),
+                    ("row_count", str(current.row_count)),
+                    ("generation", current.generation),
+                ])
+        finally:
+            conn.close()
+        
+        logger.info(f"💾 Sheet snapshot file updated ({len(changes)} rows)")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Sheet snapshot file update failed: {e}")
+        ERRORS_TOTAL.labels("snapshot_file").inc()
         return False
 
-def search_google_sheets(query: str) -> str:
-    """Search Google Sheets for the query"""
+def load_snapshot_file(path=None):
+    """Load a snapshot persisted by save_snapshot_file, or None if unusable"""
+    path = path or SNAPSHOT_CACHE_PATH
+    if not os.path.exists(path):
+        return None
     try:
-        if not worksheet:
-            return "❌ Google Sheets not connected"
-        
-        # Get all records
-        records = worksheet.get_all_records()
-        
-        # Filter records that match the query
-        matching_records = []
-        for record in records:
-            # Check if query matches in any field
-            for key, value in record.items():
-                if query.lower() in str(value).lower():
-                    matching_records.append(record)
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if meta.get("format") != SNAPSHOT_FILE_FORMAT:
+                logger.warning(f"⚠️ Ignoring snapshot file {path} with format {meta.get('format')}")
+                return None
+            
+            headers = json.loads(meta["headers"])
+            if meta.get("settings") != snapshot_settings(headers):
+                logger.warning(f"⚠️ Ignoring snapshot file {path} saved with other RESULT_LINE_MAX_LENGTH or title columns")
+                return None
+            columns = [[] for _ in headers]
+            gram_counts = array('I')
+            lines = []
+            for data, gram_count, line in conn.execute("SELECT data, gram_count, line FROM records ORDER BY row_id"):
+                for column, value in zip(columns, json.loads(data)):
+                    column.append(value)
+                gram_counts.append(gram_count)
+                lines.append(line)
+            index = {}
+            for gram, row_ids in conn.execute("SELECT gram, row_ids FROM postings"):
+                postings = array('I')
+                postings.frombytes(row_ids)
+                index[gram] = postings
+            prefixes = conn.execute("SELECT text, row_id FROM prefixes ORDER BY text, row_id").fetchall()
+        finally:
+            conn.close()
+        
+        loaded = SheetSnapshot(
+            headers,
+            columns,
+            next(_snapshot_versions),
+            lines=lines,
+            index=index,
+            gram_counts=gram_counts,
+            prefixes=prefixes,
+            loaded_at=float(meta["loaded_at"]),
+            modified_time=meta.get("modified_time"),
+            generation=meta.get("generation"),
+        )
+        logger.info(f"✅ Sheet snapshot v{loaded.version} loaded from {path} ({loaded.row_count} rows)")
+        return loaded
+        
+    except Exception as e:
+        logger.error(f"❌ Sheet snapshot file load failed: {e}")
+        ERRORS_TOTAL.labels("snapshot_file").inc()
+        return None
+
+class SharedSnapshot:
+    """Read-only view of a snapshot file shared between worker processes
+
+    Searches query SQLite directly. SQLite memory-maps the file, so every
+    worker reads the same pages of the OS page cache instead of holding its
+    own copy of the records and index.
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.local = threading.local()
+        self.inode = os.stat(path).st_ino
+        
+        meta = dict(self.connection().execute("SELECT key, value FROM meta"))
+        if meta.get("format") != SNAPSHOT_FILE_FORMAT:
+            raise ValueError(f"unsupported snapshot file format {meta.get('format')}")
+        self.headers = json.loads(meta["headers"])
+        if meta.get("settings") != snapshot_settings(self.headers):
+            raise ValueError("snapshot file saved with other RESULT_LINE_MAX_LENGTH or title columns")
+        self.column_ids = {normalize_query(header): column for column, header in enumerate(self.headers)}
+        self.title_ids = title_columns(self.headers)
+        self.loaded_at = float(meta["loaded_at"])
+        self.modified_time = meta.get("modified_time")
+        self.row_count = int(meta["row_count"])
+        self.generation = meta["generation"]
+
+    def connection(self):
+        """Return this thread's read-only connection to the snapshot file"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=5)
+            conn.execute(f"PRAGMA mmap_size={SHARED_SNAPSHOT_MMAP_SIZE}")
+            self.local.conn = conn
+        return conn
+
+    def row(self, row_id):
+        """Return the values of one row, in header order"""
+        row = self.connection().execute("SELECT data FROM records WHERE row_id = ?", (row_id,)).fetchone()
+        if row is None:
+            raise IndexError(row_id)
+        return json.loads(row[0])
+
+    def display_lines(self, row_ids):
+        """Return the pre-rendered display lines of the given rows"""
+        row_ids = list(row_ids)
+        placeholders = ",".join("?" * len(row_ids))
+        lines = dict(self.connection().execute(f"SELECT row_id, line FROM records WHERE row_id IN ({placeholders})", row_ids))
+        return [lines[row_id] for row_id in row_ids]
+
+    def age(self):
+        """Seconds since this snapshot was read from Google Sheets"""
+        return time.time() - self.loaded_at
+
+    def is_current(self):
+        """Whether the leader has not replaced or updated the file since opening"""
+        try:
+            if os.stat(self.path).st_ino != self.inode:
+                return False
+            row = self.connection().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+            return row is not None and row[0] == self.generation
+        except (OSError, sqlite3.Error):
+            return False
+
+    def _postings(self, conn, grams):
+        """Return the posting arrays for grams, or None if any gram is missing"""
+        placeholders = ",".join("?" * len(grams))
+        rows = conn.execute(f"SELECT row_ids FROM postings WHERE gram IN ({placeholders})", list(grams)).fetchall()
+        if len(rows) < len(grams):
+            return None
+        postings = []
+        for (row_ids,) in rows:
+            posting = array('I')
+            posting.frombytes(row_ids)
+            postings.append(posting)
+        return postings
+
+    def find(self, query, limit=None, column=None):
+        """Return ids of rows with a cell containing query, in sheet order"""
+        needle = query.lower()
+        grams = ngrams(needle)
+        conn = self.connection()
+        
+        # One read transaction, so a concurrent leader write can't be seen halfway
+        conn.execute("BEGIN")
+        try:
+            if column is not None:
+                return self._find_in_column(conn, needle, grams, limit, column)
+            
+            if not grams:
+                rows = conn.execute(
+                    "SELECT row_id FROM records WHERE instr(cells, ?) > 0 ORDER BY row_id LIMIT ?",
+                    (needle, -1 if limit is None else limit),
+                )
+                return [row_id for (row_id,) in rows]
+            
+            postings = self._postings(conn, grams)
+            if postings is None:
+                return []
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                if not candidates:
                     break
+                candidates.intersection_update(posting)
+            candidates = sorted(candidates)
+            
+            matches = []
+            for start in range(0, len(candidates), 500):
+                chunk = candidates[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT row_id FROM records WHERE row_id IN ({placeholders}) AND instr(cells, ?) > 0 ORDER BY row_id",
+                    chunk + [needle],
+                )
+                matches.extend(row_id for (row_id,) in rows)
+                if limit is not None and len(matches) >= limit:
+                    return matches[:limit]
+            return matches
+        finally:
+            conn.rollback()
+
+    def _find_in_column(self, conn, needle, grams, limit, column):
+        """Return ids of rows whose cell in column contains needle, in sheet order"""
+        if grams:
+            postings = self._postings(conn, grams)
+            if postings is None:
+                return []
+            candidates = sorted(set.intersection(*(set(posting) for posting in postings)))
+            rows = itertools.chain.from_iterable(
+                conn.execute(
+                    f"SELECT row_id, cells FROM records WHERE row_id IN ({','.join('?' * len(chunk))}) AND instr(cells, ?) > 0 ORDER BY row_id",
+                    chunk + [needle],
+                )
+                for chunk in (candidates[start:start + 500] for start in range(0, len(candidates), 500))
+            )
+        else:
+            rows = conn.execute("SELECT row_id, cells FROM records ORDER BY row_id")
+        
+        matches = (
+            row_id for row_id, cells in rows
+            if needle in (cells.split(CELL_SEPARATOR) + [""] * (column + 1))[column]
+        )
+        return list(itertools.islice(matches, limit))
+
+    def find_exact(self, column, value, limit=None):
+        """Return ids of rows whose cell in column equals the normalized value"""
+        rows = self.connection().execute(
+            "SELECT row_id FROM column_values WHERE col = ? AND value = ? ORDER BY row_id LIMIT ?",
+            (column, value, -1 if limit is None else limit),
+        )
+        return [row_id for (row_id,) in rows]
+
+    def rank(self, query, limit):
+        """Return ids of up to limit rows most similar to query, best first"""
+        grams = ngrams(query.lower())
+        if not grams:
+            return self.find(query, limit)
+        
+        conn = self.connection()
+        conn.execute("BEGIN")
+        try:
+            placeholders = ",".join("?" * len(grams))
+            postings = []
+            for (row_ids,) in conn.execute(f"SELECT row_ids FROM postings WHERE gram IN ({placeholders})", list(grams)):
+                posting = array('I')
+                posting.frombytes(row_ids)
+                postings.append(posting)
+            
+            # Grams missing from the index are empty postings
+            wanted = max(1, math.ceil(len(grams) * SEARCH_MIN_SIMILARITY))
+            postings += [()] * (len(grams) - len(postings))
+            matched = count_shared_grams(postings, wanted)
+            candidates = [row_id for row_id, shared in matched.items() if shared >= wanted]
+            scored = []
+            for start in range(0, len(candidates), 500):
+                chunk = candidates[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for row_id, gram_count in conn.execute(f"SELECT row_id, gram_count FROM records WHERE row_id IN ({placeholders})", chunk):
+                    shared = matched[row_id]
+                    scored.append((shared / (len(grams) + gram_count - shared), -row_id))
+            return [-row_id for _, row_id in heapq.nlargest(limit, scored)]
+        finally:
+            conn.rollback()
+
+    def complete(self, prefix, offset, limit):
+        """Return up to limit ids of rows with a title word starting with prefix"""
+        conn = self.connection()
+        conn.execute("BEGIN")
+        try:
+            entries = itertools.takewhile(
+                lambda entry: entry[0].startswith(prefix),
+                conn.execute("SELECT text, row_id FROM prefixes WHERE text >= ? ORDER BY text, row_id", (prefix,)),
+            )
+            page = list(itertools.islice(distinct_rows(entries), offset, offset + limit + 1))
+            return page[:limit], len(page) > limit
+        finally:
+            conn.rollback()
+
+def open_shared_snapshot(path=None):
+    """Open the leader's snapshot file as a SharedSnapshot, or None if unusable"""
+    path = path or SNAPSHOT_CACHE_PATH
+    if not os.path.exists(path):
+        return None
+    try:
+        shared = SharedSnapshot(path, next(_snapshot_versions))
+        logger.info(f"✅ Shared sheet snapshot v{shared.version} opened ({shared.row_count} rows)")
+        return shared
+    except Exception as e:
+        logger.error(f"❌ Shared sheet snapshot open failed: {e}")
+        ERRORS_TOTAL.labels("snapshot_file").inc()
+        return None
+
+def acquire_leadership():
+    """Try to become the process that owns Sheets refreshes and the webhook"""
+    global leader_lock_file
+    if leader_lock_file:
+        return True
+    import fcntl
+    
+    lock_file = open(f"{SNAPSHOT_CACHE_PATH}.lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    
+    # The lock lives as long as the file stays open, i.e. until this process exits
+    leader_lock_file = lock_file
+    logger.info(f"👑 Process {os.getpid()} is the snapshot leader")
+    return True
+
+async def follow_shared_snapshot():
+    """Pick up the leader's snapshot file updates, taking over if the leader exits"""
+    global snapshot
+    while True:
+        await asyncio.sleep(SHARED_SNAPSHOT_POLL_INTERVAL)
+        
+        if acquire_leadership():
+            # Keep serving the shared file until our own snapshot is loaded
+            loaded = await run_sheets_io(load_snapshot_file)
+            if loaded:
+                snapshot = loaded
+            await refresh_snapshot_periodically(delay=0)
+            return
+        
+        current = snapshot
+        if current is None or not await asyncio.to_thread(current.is_current):
+            shared = await asyncio.to_thread(open_shared_snapshot)
+            if shared:
+                snapshot = shared
+
+def is_snapshot_leader():
+    """Whether this process owns Sheets refreshes"""
+    return not SHARED_SNAPSHOT or leader_lock_file is not None
+
+def request_sync(first_row=None, last_row=None):
+    """Schedule a debounced sync of sheet rows first_row to last_row, or of the whole sheet
+
+    Requests arriving while a sync is pending widen its row range instead of
+    adding another sync. Returns the task that will run the sync, or None if
+    the request was forwarded to the leader process.
+    """
+    global pending_sync, pending_sync_task, last_sync_request
+    if not is_snapshot_leader():
+        forward_sync_request(first_row, last_row)
+        return None
+    
+    if pending_sync is None:
+        pending_sync = (first_row, last_row)
+    elif first_row is None or pending_sync[0] is None:
+        pending_sync = (None, None)
+    else:
+        pending_sync = (min(pending_sync[0], first_row), max(pending_sync[1], last_row))
+    
+    last_sync_request = time.monotonic()
+    if pending_sync_task is None:
+        pending_sync_task = asyncio.create_task(run_pending_sync())
+    return pending_sync_task
+
+async def run_pending_sync():
+    """Wait for a burst of sync requests to go quiet, then sync once"""
+    global pending_sync, pending_sync_task
+    deadline = time.monotonic() + SHEET_PUSH_MAX_DELAY
+    while True:
+        delay = min(last_sync_request + SHEET_PUSH_DEBOUNCE, deadline) - time.monotonic()
+        if delay <= 0:
+            break
+        await asyncio.sleep(delay)
+    
+    # Requests from here on start a new burst and a new sync
+    first_row, last_row = pending_sync
+    pending_sync = None
+    pending_sync_task = None
+    
+    # An explicit whole-sheet request re-reads even if Drive's modifiedTime,
+    # which can lag behind an edit, looks unchanged
+    return await refresh_snapshot(first_row, last_row, first_row is None)
+
+def forward_sync_request(first_row, last_row):
+    """Append a sync request to the file the leader process picks requests up from"""
+    with open(f"{SNAPSHOT_CACHE_PATH}.sync", "a") as f:
+        f.write(f"{first_row or 0} {last_row or 0}\n")
+
+async def watch_sync_requests():
+    """Schedule the sync requests other workers forwarded, while this process leads"""
+    path = f"{SNAPSHOT_CACHE_PATH}.sync"
+    while True:
+        await asyncio.sleep(SHARED_SNAPSHOT_POLL_INTERVAL)
+        if not leader_lock_file or not os.path.exists(path):
+            continue
+        try:
+            # Move the file aside first so requests appended meanwhile land
+            # in a new file instead of being lost
+            taken = f"{path}.taken"
+            os.replace(path, taken)
+            with open(taken) as f:
+                requests = [line.split() for line in f if line.strip()]
+            os.remove(taken)
+            
+            for first_row, last_row in requests:
+                request_sync(int(first_row) or None, int(last_row) or None)
+        except Exception as e:
+            logger.error(f"❌ Forwarded sync requests failed: {e}")
+            ERRORS_TOTAL.labels("snapshot_sync").inc()
+
+# An A1 range like "Sheet1!B5:D7"; whole-column ranges like "A:C" have no rows
+A1_RANGE = re.compile(r"^(?:.*!)?\$?[A-Za-z]*\$?(\d*)(?::\$?[A-Za-z]*\$?(\d*))?$")
+
+def edited_rows(data):
+    """Return the (first_row, last_row) an edit notification covers, or None if malformed
+
+    The notification is {"range": "<A1 range>"} or {"first_row": n, "last_row": m}.
+    Ranges without row numbers and empty notifications cover the whole sheet,
+    returned as (None, None).
+    """
+    if not isinstance(data, dict):
+        return None
+    if "range" in data:
+        match = A1_RANGE.match(str(data["range"]))
+        if not match:
+            return None
+        if not match.group(1) or match.group(2) == "":
+            return None, None
+        first_row = int(match.group(1))
+        last_row = int(match.group(2) or first_row)
+    elif "first_row" in data:
+        first_row = data["first_row"]
+        last_row = data.get("last_row", first_row)
+    else:
+        return None, None
+    
+    if not isinstance(first_row, int) or not isinstance(last_row, int) or not 1 <= first_row <= last_row:
+        return None
+    return first_row, last_row
+
+class Trace:
+    """Stage timings of one update on its way through the bot
+
+    Each mark() closes the stage that ran since the previous one, so
+    recording a stage costs a perf_counter() call and a list append.
+    """
+
+    __slots__ = ("update", "sampled", "started", "last", "stages")
+
+    def __init__(self, update, started, sampled):
+        self.update = update
+        self.sampled = sampled
+        self.started = started
+        self.last = started
+        self.stages = []
+
+    def mark(self, stage):
+        """Close stage, which ran from the previous mark until now"""
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def record(self):
+        """Return the trace as a JSON-serializable slow-query log entry"""
+        stages = Counter()
+        for stage, seconds in self.stages:
+            stages[stage] += seconds
+        update = self.update
+        if update.message and update.message.text:
+            query = update.message.text
+        elif update.inline_query:
+            query = update.inline_query.query
+        elif update.callback_query:
+            query = update.callback_query.data
+        else:
+            query = None
+        return {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "update_id": update.update_id,
+            "type": update_type(update),
+            "query": query,
+            "snapshot_version": snapshot.version if snapshot else None,
+            "total_ms": round((self.last - self.started) * 1000, 3),
+            "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in stages.items()},
+        }
+
+# The trace of the update being processed; asyncio.to_thread carries it into
+# the search threads
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+def mark_stage(stage):
+    """Close stage in the current update's trace, if it has one"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.mark(stage)
+
+def finish_trace(trace):
+    """Feed a processed update's stages to the metrics if sampled and to the slow-query log if slow"""
+    trace.mark("other")
+    if trace.sampled:
+        for stage, seconds in trace.stages:
+            UPDATE_STAGE_SECONDS.labels(stage).observe(seconds)
+    if SLOW_QUERY_SECONDS > 0 and trace.last - trace.started >= SLOW_QUERY_SECONDS:
+        SLOW_QUERIES.inc()
+        slow_query_logger.warning(json.dumps(trace.record(), ensure_ascii=False))
+
+def search_google_sheets(query: str):
+    """Search the sheet snapshot for the query, returning the reply text and keyboard"""
+    try:
+        mark_stage("dispatch")
+        current = snapshot
+        if not current:
+            # Startup couldn't read the sheet yet; it keeps retrying
+            return "⏳ The catalogue is still loading, please try again in a minute.", None
         
-        if not matching_records:
-            return f"❌ No results found for '{query}'"
+        scoped = parse_scoped_query(query, current.column_ids)
+        if scoped and not scoped[2]:
+            header = current.headers[scoped[0]]
+            return f"❌ Please add a value to search for after '{header}{scoped[1]}'.", None
         
-        # Format results
-        result_text = f"🔍 Search Results for '{query}':\n\n"
-        for i, record in enumerate(matching_records[:5], 1):  # Limit to 5 results
-            result_text += f"{i}. "
-            for key, value in record.items():
-                if value:  # Only show non-empty values
-                    result_text += f"{key}: {value} | "
-            result_text = result_text.rstrip(" | ") + "\n\n"
+        token, cursor = search_cursor(current, query)
+        mark_stage("search")
         
-        return result_text
+        if not cursor.row_ids:
+            SEARCHES_TOTAL.labels("miss").inc()
+            return f"❌ No results found for '{query}'", None
+        
+        SEARCHES_TOTAL.labels("hit").inc()
+        page = render_page(current, token, cursor, 0, query)
+        mark_stage("format")
+        return page
     except Exception as e:
         logger.error(f"❌ Search failed: {e}")
-        return f"❌ Search error: {str(e)}"
+        ERRORS_TOTAL.labels("search").inc()
+        return f"❌ Search error: {str(e)}", None
+
+class SendRate:
+    """Token bucket allowing rate sends per second in bursts of up to burst
+
+    Only the time the next send is due is kept (the generic cell rate
+    algorithm), so a bucket costs one float however busy the chat is.
+    """
+
+    def __init__(self, rate, burst):
+        self.interval = 1 / rate
+        self.tolerance = (max(1, burst) - 1) * self.interval
+        self.due = 0.0
+
+    def earliest(self, now):
+        """Earliest time from now a send fits in the bucket"""
+        return max(now, self.due - self.tolerance)
+
+    def take(self, at):
+        """Record a send at monotonic time at"""
+        self.due = max(self.due, at) + self.interval
+
+class SendScheduler(BaseRateLimiter):
+    """Spaces outgoing Bot API messages to Telegram's flood limits
+
+    Messages are spaced per chat and overall so a burst of updates is
+    answered a little later rather than with 429 errors. A 429 that gets
+    through pauses every send for its retry_after before the request is
+    retried. Callback and inline query answers are never delayed, and a
+    typing action is dropped while its chat already has a reply on the way.
+    """
+
+    def __init__(self):
+        self.overall = SendRate(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE) if TELEGRAM_GLOBAL_RATE > 0 else None
+        self.chats = {}
+        self.typing = {}
+        self.pending = Counter()
+        self.paused_until = 0.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def pending_sends(self):
+        """Number of sends being spaced or awaiting Telegram"""
+        return sum(self.pending.values())
+
+    def stats(self):
+        return {
+            "pending_sends": self.pending_sends(),
+            "chats": len(self.chats),
+            "flood_wait_seconds": round(max(0.0, self.paused_until - time.monotonic()), 1),
+        }
+
+    def chat_rate(self, chat_id):
+        """Return the bucket spacing messages to chat_id, or None if unlimited"""
+        rate = self.chats.get(chat_id)
+        if rate is None:
+            # Group and channel ids are negative or @usernames
+            is_group = str(chat_id).startswith(("-", "@"))
+            per_second = TELEGRAM_GROUP_RATE / 60 if is_group else TELEGRAM_CHAT_RATE
+            if per_second <= 0:
+                return None
+            if len(self.chats) >= SEND_TRACKED_CHATS:
+                self.forget_idle(time.monotonic())
+            rate = self.chats[chat_id] = SendRate(per_second, TELEGRAM_CHAT_BURST)
+        return rate
+
+    def forget_idle(self, now):
+        """Drop the state of chats whose buckets have refilled"""
+        self.chats = {chat_id: rate for chat_id, rate in self.chats.items() if rate.due > now}
+        self.typing = {chat_id: sent for chat_id, sent in self.typing.items() if sent > now - TYPING_ACTION_SECONDS}
+
+    async def wait_turn(self, chat_id):
+        """Sleep until the chat's and the overall limits and any flood wait allow a send"""
+        now = time.monotonic()
+        buckets = [bucket for bucket in (self.overall, self.chat_rate(chat_id) if chat_id is not None else None) if bucket]
+        at = max([now, self.paused_until] + [bucket.earliest(now) for bucket in buckets])
+        for bucket in buckets:
+            bucket.take(at)
+        
+        # A 429 received while this send waited pauses it further
+        while at > now:
+            TELEGRAM_SEND_WAIT_SECONDS.inc(at - now)
+            await asyncio.sleep(at - now)
+            now = time.monotonic()
+            at = self.paused_until
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if endpoint == "sendChatAction":
+            return await self.chat_action(callback, args, kwargs, chat_id, data.get("action"))
+        if endpoint.startswith("answer") or (chat_id is None and "inline_message_id" not in data):
+            # Query answers must be quick and setup calls aren't messages
+            return await callback(*args, **kwargs)
+        
+        self.pending[chat_id] += 1
+        try:
+            for attempt in itertools.count():
+                await self.wait_turn(chat_id)
+                try:
+                    return await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    TELEGRAM_FLOOD_WAITS.inc()
+                    if attempt >= TELEGRAM_MAX_RETRIES or e.retry_after > TELEGRAM_MAX_RETRY_AFTER:
+                        raise
+                    self.paused_until = max(self.paused_until, time.monotonic() + e.retry_after)
+                    logger.warning(f"⚠️ Telegram flood limit on {endpoint}, retry {attempt + 1} in {e.retry_after}s")
+        finally:
+            self.pending[chat_id] -= 1
+            if not self.pending[chat_id]:
+                del self.pending[chat_id]
+
+    async def chat_action(self, callback, args, kwargs, chat_id, action):
+        """Send a chat action unless it is a typing action the chat doesn't need"""
+        now = time.monotonic()
+        if action == ChatAction.TYPING:
+            if self.pending.get(chat_id) or now < self.paused_until or now - self.typing.get(chat_id, -math.inf) < TYPING_ACTION_SECONDS:
+                TELEGRAM_DROPPED_ACTIONS.inc()
+                return True
+            if len(self.typing) >= SEND_TRACKED_CHATS:
+                self.forget_idle(now)
+            self.typing[chat_id] = now
+        return await callback(*args, **kwargs)
+
+send_scheduler = SendScheduler()
+
+async def search_with_typing(message, query):
+    """Search in a thread, showing "typing" in the chat if the search is slow"""
+    search = asyncio.create_task(asyncio.to_thread(search_google_sheets, query))
+    done, _ = await asyncio.wait({search}, timeout=TYPING_ACTION_DELAY)
+    if not done:
+        try:
+            await message.reply_chat_action(ChatAction.TYPING)
+        except Exception as e:
+            logger.warning(f"⚠️ Typing action failed: {e}")
+    return await search
+
+async def send_reply(message, text, reply_markup=None):
+    """Reply to a message, recording the Telegram round-trip latency"""
+    mark_stage("dispatch")
+    chunks = split_message(text)
+    with REPLY_SECONDS.time():
+        for chunk in chunks[:-1]:
+            await message.reply_text(chunk)
+        await message.reply_text(chunks[-1], reply_markup=reply_markup)
+    mark_stage("reply")
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
@@ -141,10 +1963,13 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "🤖 Welcome to MonkTV Search Bot!\n\n"
             "Use /search <query> to search our database.\n"
-            "Example: /search your query here"
+            "Example: /search your query here\n\n"
+            "Search one column with column:value, or match it exactly with column=value.\n"
+            "Example: /search year=2023"
         )
     except Exception as e:
         logger.error(f"❌ Start command failed: {e}")
+        ERRORS_TOTAL.labels("handler").inc()
 
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /search command"""
@@ -156,14 +1981,15 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = ' '.join(context.args)
         logger.info(f"🔍 Searching for: {query}")
         
-        # Search Google Sheets
-        result = search_google_sheets(query)
+        # Search Google Sheets without holding up the event loop
+        result, reply_markup = await search_with_typing(update.message, query)
         
         # Send result
-        await update.message.reply_text(result)
+        await send_reply(update.message, result, reply_markup)
         
     except Exception as e:
         logger.error(f"❌ Search command failed: {e}")
+        ERRORS_TOTAL.labels("handler").inc()
         await update.message.reply_text(f"❌ Search failed: {str(e)}")
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -174,50 +2000,285 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # If message doesn't start with /, treat as search
         if not message.startswith('/'):
-            result = search_google_sheets(message)
-            await update.message.reply_text(result)
+            result, reply_markup = await search_with_typing(update.message, message)
+            await send_reply(update.message, result, reply_markup)
         else:
             await update.message.reply_text("❌ Unknown command. Use /search <query> to search.")
             
     except Exception as e:
         logger.error(f"❌ Message handling failed: {e}")
+        ERRORS_TOTAL.labels("handler").inc()
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Manage application lifespan"""
-    global application
-    
+async def page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle Next/Prev buttons by paging through a cached match cursor"""
+    callback = update.callback_query
     try:
-        # Load environment variables
-        if not load_environment_variables():
-            raise Exception("Environment setup failed")
+        _, token, page = callback.data.split(":")
+        cursor = cursor_cache.get(token)
+        current = snapshot
         
-        # Setup Google Sheets
-        if not setup_google_sheets():
-            raise Exception("Google Sheets setup failed")
+        if current is not None and (cursor is None or cursor.generation != current.generation):
+            # Another worker ran the search, the cursor was evicted or the
+            # sheet changed since: search again for the query the page shows
+            header = RESULTS_HEADER.match(callback.message.text or "") if callback.message else None
+            if header:
+                token, cursor = await asyncio.to_thread(search_cursor, current, header.group(1))
         
-        # Initialize bot
-        logger.info("🚀 Starting bot initialization...")
+        if cursor is None or current is None or cursor.generation != current.generation or not cursor.row_ids:
+            await callback.answer("⌛ These results have expired. Please search again.", show_alert=True)
+            return
+        
+        text, reply_markup = render_page(current, token, cursor, int(page), cursor.query)
+        mark_stage("format")
+        await callback.answer()
+        
+        # A page too long for one message continues in new messages, with
+        # the buttons under the last one
+        chunks = split_message(text)
+        await callback.edit_message_text(chunks[0], reply_markup=reply_markup if len(chunks) == 1 else None)
+        for n, chunk in enumerate(chunks[1:], 2):
+            await callback.message.reply_text(chunk, reply_markup=reply_markup if n == len(chunks) else None)
+        mark_stage("reply")
+        
+    except Exception as e:
+        logger.error(f"❌ Page callback failed: {e}")
+        ERRORS_TOTAL.labels("handler").inc()
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle @bot <prefix> inline queries from the title prefix index"""
+    try:
+        current = snapshot
+        prefix = normalize_query(update.inline_query.query)
+        if not current or not prefix:
+            await update.inline_query.answer([], cache_time=INLINE_CACHE_TIME)
+            return
         
-        application = (
-            Application.builder()
-            .token(os.getenv('BOT_TOKEN'))
-            .build()
+        offset = int(update.inline_query.offset or 0)
+        row_ids, has_more = await asyncio.to_thread(current.complete, prefix, offset, INLINE_PAGE_SIZE)
+        mark_stage("search")
+        
+        results = []
+        for row_id, line in zip(row_ids, current.display_lines(row_ids)):
+            row = current.row(row_id)
+            title = " / ".join(display_value(row[column]) for column in current.title_ids if row[column]) or "Untitled"
+            text = line or title
+            results.append(InlineQueryResultArticle(
+                id=str(row_id),
+                title=title[:256],
+                description=text[:256],
+                input_message_content=InputTextMessageContent(text[:MessageLimit.MAX_TEXT_LENGTH]),
+            ))
+        
+        mark_stage("format")
+        
+        # Telegram caches each (query, offset) page, absorbing repeat keystrokes
+        await update.inline_query.answer(
+            results,
+            cache_time=INLINE_CACHE_TIME,
+            next_offset=str(offset + len(row_ids)) if has_more else "",
         )
+        mark_stage("reply")
         
-        # Add handlers
-        application.add_handler(CommandHandler("start", start_command))
-        application.add_handler(CommandHandler("search", search_command))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    except Exception as e:
+        logger.error(f"❌ Inline query failed: {e}")
+        ERRORS_TOTAL.labels("handler").inc()
+
+async def reload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /reload command: re-read the sheet now (admins only)"""
+    try:
+        user = update.effective_user
+        if user is None or user.id not in ADMIN_USER_IDS:
+            await update.message.reply_text("⛔ /reload is only available to admins.")
+            return
         
-        # Initialize application
-        await application.initialize()
+        # Repeated /reloads within the debounce window share one sync
+        task = request_sync()
+        if task is None:
+            await update.message.reply_text("🔄 Reload requested from the worker that owns the sheet.")
+            return
         
-        # Set webhook
-        webhook_url = f"{os.getenv('WEBHOOK_URL')}/telegram/webhook"
-        await application.bot.set_webhook(webhook_url)
+        synced = await asyncio.shield(task)
+        mark_stage("sync")
+        if synced:
+            current = snapshot
+            await update.message.reply_text(f"✅ Sheet reloaded: snapshot v{current.version}, {current.row_count} rows")
+        else:
+            await update.message.reply_text("❌ Sheet reload failed, still serving the previous snapshot")
+        
+    except Exception as e:
+        logger.error(f"❌ Reload command failed: {e}")
+        ERRORS_TOTAL.labels("handler").inc()
+
+async def process_updates_worker():
+    """Drain the update queue, processing one update at a time"""
+    global busy_workers
+    while True:
+        update, trace = await update_queue.get()
+        busy_workers += 1
+        current_trace.set(trace)
+        if trace is not None:
+            trace.mark("queue")
+        try:
+            with UPDATE_SECONDS.time():
+                await application.process_update(update)
+            update_stats["processed"] += 1
+        except Exception as e:
+            update_stats["failed"] += 1
+            logger.error(f"❌ Update {update.update_id} processing failed: {e}")
+            ERRORS_TOTAL.labels("update").inc()
+        finally:
+            if trace is not None:
+                finish_trace(trace)
+            busy_workers -= 1
+            update_queue.task_done()
+
+def update_type(update):
+    """Classify an update by the handler that will process it"""
+    if update.message and update.message.text:
+        return "command" if update.message.text.startswith('/') else "message"
+    for kind in ("edited_message", "callback_query", "inline_query"):
+        if getattr(update, kind):
+            return kind
+    return "other"
+
+def remember_update_id(update_id):
+    """Record update_id in the bounded window of recently queued updates"""
+    recent_update_ids[update_id] = None
+    if len(recent_update_ids) > UPDATE_DEDUP_WINDOW:
+        recent_update_ids.popitem(last=False)
+
+async def start_snapshot(is_leader):
+    """Load the sheet snapshot and start keeping it fresh"""
+    global snapshot, refresh_task, sync_watch_task
+    
+    # Serve from the persisted snapshot straight away when there is one
+    # and revalidate against Google Sheets in the background
+    if not is_leader:
+        # Another worker owns Sheets; search its snapshot file instead
+        snapshot = open_shared_snapshot()
+        refresh_task = asyncio.create_task(follow_shared_snapshot())
+    else:
+        snapshot = await run_sheets_io(load_snapshot_file)
+        if snapshot:
+            refresh_task = asyncio.create_task(refresh_snapshot_periodically(delay=0))
+        elif await refresh_snapshot():
+            # Keep the initial snapshot fresh in the background
+            refresh_task = asyncio.create_task(refresh_snapshot_periodically())
+        else:
+            # Answer webhooks anyway and keep retrying Sheets in the background
+            logger.warning("⚠️ Starting without a sheet snapshot, retrying Google Sheets in the background")
+            refresh_task = asyncio.create_task(refresh_snapshot_periodically(delay=jittered_backoff(0, SHEET_REFRESH_INTERVAL)))
+    
+    # Whichever worker leads schedules the sync requests the others forward
+    if SHARED_SNAPSHOT:
+        sync_watch_task = asyncio.create_task(watch_sync_requests())
+
+def build_application():
+    """Build the Telegram application with its handlers"""
+    bot_application = (
+        Application.builder()
+        .token(os.getenv('BOT_TOKEN'))
+        .base_url(BOT_API_BASE_URL)
+        .connection_pool_size(TELEGRAM_POOL_SIZE)
+        .pool_timeout(TELEGRAM_POOL_TIMEOUT)
+        .connect_timeout(TELEGRAM_CONNECT_TIMEOUT)
+        .read_timeout(TELEGRAM_READ_TIMEOUT)
+        .write_timeout(TELEGRAM_WRITE_TIMEOUT)
+        .http_version(TELEGRAM_HTTP_VERSION)
+        .rate_limiter(send_scheduler)
+        .build()
+    )
+    
+    # Add handlers
+    bot_application.add_handler(CommandHandler("start", start_command))
+    bot_application.add_handler(CommandHandler("search", search_command))
+    bot_application.add_handler(CommandHandler("reload", reload_command))
+    bot_application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    bot_application.add_handler(InlineQueryHandler(inline_query))
+    bot_application.add_handler(CallbackQueryHandler(page_callback, pattern=r"^page:"))
+    return bot_application
+
+async def ensure_webhook(bot):
+    """Register the webhook with Telegram unless it is already registered"""
+    webhook_url = f"{os.getenv('WEBHOOK_URL')}/telegram/webhook"
+    info = await bot.get_webhook_info()
+    if info.url == webhook_url:
+        logger.info("✅ Webhook already set")
+        return
+    await bot.set_webhook(webhook_url)
+    logger.info(f"✅ Webhook set to {webhook_url}")
+
+async def start_application(is_leader):
+    """Initialize the Telegram application and start accepting updates
+
+    Network errors and timeouts are retried up to BOT_INIT_MAX_ATTEMPTS times.
+    Anything else, like an invalid BOT_TOKEN, won't go away by retrying and
+    is raised straight away.
+    """
+    global application, update_queue
+    bot_application = build_application()
+    for attempt in itertools.count(1):
+        try:
+            await bot_application.initialize()
+            break
+        except (NetworkError, RetryAfter) as e:
+            if isinstance(e, BadRequest) or attempt >= BOT_INIT_MAX_ATTEMPTS:
+                raise
+            if isinstance(e, RetryAfter):
+                delay = e.retry_after
+            else:
+                delay = jittered_backoff(attempt - 1, BOT_INIT_BACKOFF_MAX, BOT_INIT_BACKOFF_BASE)
+            logger.error(f"❌ Bot initialization failed: {e}, retrying in {delay:.1f}s")
+            ERRORS_TOTAL.labels("startup").inc()
+            await asyncio.sleep(delay)
+    
+    # Start the workers that process queued webhook updates
+    update_queue = asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE)
+    for _ in range(UPDATE_WORKERS):
+        update_workers.append(asyncio.create_task(process_updates_worker()))
+    application = bot_application
+    
+    # Set webhook; with a shared snapshot only the leader registers it
+    if is_leader:
+        try:
+            await ensure_webhook(application.bot)
+        except Exception as e:
+            logger.error(f"❌ Webhook registration failed: {e}")
+            ERRORS_TOTAL.labels("startup").inc()
+
+async def start_bot():
+    """Load the snapshot and start the Telegram application side by side"""
+    global startup_seconds, startup_error
+    started = time.monotonic()
+    try:
+        logger.info("🚀 Starting bot initialization...")
+        is_leader = not SHARED_SNAPSHOT or acquire_leadership()
+        await asyncio.gather(start_snapshot(is_leader), start_application(is_leader))
+        startup_seconds = time.monotonic() - started
+        logger.info(f"✅ Bot initialized successfully in {startup_seconds:.1f}s")
+    except Exception as e:
+        startup_error = f"{type(e).__name__}: {e}"
+        logger.critical(f"❌ Bot setup failed, GET / now answers 503: {startup_error}")
+        ERRORS_TOTAL.labels("startup").inc()
+
+def is_ready():
+    """Whether updates are accepted and searches are answered from a snapshot"""
+    return application is not None and snapshot is not None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Manage application lifespan"""
+    global startup_task
+    
+    try:
+        # Load environment variables
+        if not load_environment_variables():
+            raise Exception("Environment setup failed")
         
-        logger.info("✅ Bot initialized successfully")
+        # uvicorn accepts no requests until this yields, so the rest of the
+        # startup runs in the background; GET / answers meanwhile and
+        # GET /ready once the bot can answer searches
+        startup_task = asyncio.create_task(start_bot())
         
         yield
         
@@ -226,38 +2287,204 @@ async def lifespan(app: FastAPI):
         raise
     finally:
         # Cleanup
+        for task in (startup_task, refresh_task, sync_watch_task, pending_sync_task):
+            if task:
+                task.cancel()
+        for worker in update_workers:
+            worker.cancel()
         if application:
             await application.shutdown()
+        sheets_executor.shutdown(wait=False, cancel_futures=True)
 
 # Create FastAPI app
 app = FastAPI(lifespan=lifespan)
 
 @app.get("/")
-async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy", "message": "MonkTV Bot is running"}
+async def health_check(response: Response):
+    """Health check endpoint; answers as soon as the process is up, and 503 once startup has failed"""
+    current = snapshot
+    if startup_error is not None:
+        response.status_code = 503
+        return {"status": "failed", "error": startup_error}
+    return {
+        "status": "healthy",
+        "message": "MonkTV Bot is running",
+        "ready": is_ready(),
+        "startup_seconds": round(startup_seconds, 2) if startup_seconds is not None else None,
+        "snapshot": {
+            "version": current.version if current else None,
+            "rows": current.row_count if current else 0,
+            "age_seconds": round(current.age(), 1) if current else None,
+            "stale": sheets_failing_since is not None,
+            "failing_seconds": round(time.time() - sheets_failing_since, 1) if sheets_failing_since is not None else None,
+        },
+        "sheets_reads_last_minute": sheets_reads.recent(),
+        "updates": {
+            **update_stats,
+            "queue_depth": update_queue.qsize() if update_queue else 0,
+            "queue_size": UPDATE_QUEUE_SIZE,
+            "busy_workers": busy_workers,
+            "worker_utilization": round(busy_workers / UPDATE_WORKERS, 2) if UPDATE_WORKERS else 0,
+        },
+        "telegram": send_scheduler.stats(),
+        "result_cache": result_cache.stats(),
+        "cursor_cache": cursor_cache.stats(),
+    }
+
+@app.get("/ready")
+async def readiness_check(response: Response):
+    """Readiness endpoint: 503 until the bot accepts updates and has a snapshot to search"""
+    if not is_ready():
+        response.status_code = 503
+    return {"ready": is_ready(), "bot": application is not None, "snapshot": snapshot is not None}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics endpoint"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.post("/telegram/webhook")
 async def telegram_webhook(request: Request):
     """Handle Telegram webhooks"""
+    with WEBHOOK_SECONDS.time():
+        return await accept_update(request)
+
+@app.post("/sheets/webhook", status_code=202)
+async def sheets_webhook(request: Request):
+    """Handle edit notifications from the spreadsheet, e.g. an Apps Script onEdit trigger"""
+    check_bearer(request, SHEET_PUSH_SECRET)
+    
+    # An empty body asks for the whole sheet, like {}
+    body = await request.body()
+    try:
+        data = json.loads(body) if body.strip() else {}
+    except ValueError:
+        data = None
+    rows = edited_rows(data)
+    if rows is None:
+        raise HTTPException(status_code=400, detail="Invalid edit notification")
+    
+    request_sync(*rows)
+    return {"status": "scheduled", "first_row": rows[0], "last_row": rows[1]}
+
+@app.get("/debug/profile")
+async def profile(request: Request, seconds: float = 10, mode: str = "stack"):
+    """Profile the live process for a few seconds (admins with PROFILE_SECRET only)
+
+    mode=stack samples every thread's stack and returns folded stacks for
+    flame graph tools; mode=cprofile runs cProfile on the event loop thread
+    and returns the functions by cumulative time.
+    """
+    global profiling
+    check_bearer(request, PROFILE_SECRET)
+    if mode not in ("stack", "cprofile"):
+        raise HTTPException(status_code=400, detail="mode must be stack or cprofile")
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}")
+    if profiling:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    
+    profiling = True
+    try:
+        logger.info(f"🔬 Capturing a {seconds:g}s {mode} profile")
+        if mode == "stack":
+            return PlainTextResponse(await asyncio.to_thread(sample_stacks, seconds))
+        return PlainTextResponse(await profile_event_loop(seconds))
+    finally:
+        profiling = False
+
+def check_bearer(request: Request, secret):
+    """Reject a request unless it carries Authorization: Bearer <secret>; 404 while secret is unset"""
+    if not secret:
+        raise HTTPException(status_code=404, detail="Not Found")
+    
+    authorization = request.headers.get("Authorization", "").encode()
+    if not hmac.compare_digest(authorization, f"Bearer {secret}".encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+def sample_stacks(seconds):
+    """Sample all other threads' stacks for seconds, returning them in folded format"""
+    samples = Counter()
+    sampler = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == sampler:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            samples[";".join(reversed(stack))] += 1
+        time.sleep(PROFILE_SAMPLE_INTERVAL)
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+async def profile_event_loop(seconds):
+    """cProfile the event loop thread for seconds, returning the top functions by cumulative time"""
+    import cProfile
+    import io
+    import pstats
+    
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(100)
+    return output.getvalue()
+
+async def accept_update(request: Request):
+    """Validate a webhook update and queue it for the workers"""
+    received = time.perf_counter()
     try:
         if not application:
-            logger.error("❌ Application not initialized")
-            raise HTTPException(status_code=500, detail="Bot not initialized")
+            # Still starting up; Telegram redelivers the update later
+            raise HTTPException(status_code=503, detail="Bot starting")
         
         # Get update data
         data = await request.json()
+        if not isinstance(data, dict) or not isinstance(data.get("update_id"), int):
+            raise HTTPException(status_code=400, detail="Invalid update")
+        
+        # Telegram redelivers updates it did not get a timely answer for
+        update_stats["received"] += 1
+        if data["update_id"] in recent_update_ids:
+            update_stats["duplicates"] += 1
+            return {"status": "duplicate"}
         
         # Create update object
         update = Update.de_json(data, application.bot)
         
-        # Process update
-        await application.process_update(update)
+        # Every update is timed when slow queries are logged; a sample of
+        # them also feeds the per-stage metrics
+        sampled = random.random() < TRACE_SAMPLE_RATE
+        trace = Trace(update, received, sampled) if sampled or SLOW_QUERY_SECONDS > 0 else None
+        if trace is not None:
+            trace.mark("accept")
+        
+        # Queue the update and acknowledge straight away; when the queue is
+        # full, 429 makes Telegram retry the update later
+        try:
+            update_queue.put_nowait((update, trace))
+        except asyncio.QueueFull:
+            update_stats["rejected"] += 1
+            logger.warning(f"⚠️ Update queue full, rejecting update {update.update_id}")
+            raise HTTPException(status_code=429, detail="Update queue full")
+        remember_update_id(update.update_id)
+        UPDATES_TOTAL.labels(update_type(update)).inc()
         
         return {"status": "ok"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Webhook error: {e}")
+        ERRORS_TOTAL.labels("webhook").inc()
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
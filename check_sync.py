@@ -0,0 +1,178 @@
+"""Check incremental snapshot syncs against full rebuilds on a fake worksheet
+
+Applies random edits to a fake_sheets.FakeWorksheet: cell edits, blanked
+rows, appends, trailing rows cleared and deletions. Most edits are followed
+by a row-range sync, as an edit notification would trigger, and the rest
+by a full sync. Deletions send no notification, so they are followed by a
+full sync, sometimes after a range sync of an unrelated row. After every
+full sync and every range sync that follows a notified edit, the patched snapshot and the snapshot
+file it was written to must equal a snapshot built from scratch. Each seed
+runs once on the catalogue layout and once with a second title column,
+"Original Name", that often repeats words of the title. The script exits
+non-zero and describes the first mismatch otherwise:
+
+    python check_sync.py --edits 500 --seeds 10
+"""
+import os
+import sys
+import random
+import logging
+import argparse
+import tempfile
+
+# Keep the check from touching the bot's real snapshot file or read budget
+os.environ["SNAPSHOT_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="check-sync-"), "sheet_snapshot.db")
+os.environ.setdefault("SHEETS_READS_PER_MINUTE", "1000000")
+
+import bot
+from fake_sheets import FakeWorksheet, synthetic_values
+
+def snapshot_state(current):
+    """Everything a snapshot serves searches from, as plain comparable values"""
+    return {
+        "headers": list(current.headers),
+        "row_count": current.row_count,
+        "columns": [list(column) for column in current.columns],
+        "folded": [list(column) for column in current.folded],
+        "lines": list(current.lines),
+        "index": {gram: list(row_ids) for gram, row_ids in current.index.items()},
+        "gram_counts": list(current.gram_counts),
+        "prefixes": [tuple(entry) for entry in current.prefixes],
+        "exact": [{value: list(row_ids) for value, row_ids in column.items()} for column in current.exact],
+    }
+
+def first_difference(actual, expected):
+    """Name the first part of two snapshot states that differs, or None"""
+    for name, value in expected.items():
+        if actual[name] != value:
+            if isinstance(value, dict):
+                keys = sorted(set(actual[name]) ^ set(value)) or sorted(key for key in value if actual[name][key] != value[key])
+                return f"{name} differs at {keys[:5]}"
+            if isinstance(value, list) and len(actual[name]) == len(value):
+                position = next(n for n, (a, b) in enumerate(zip(actual[name], value)) if a != b)
+                return f"{name} differs at {position}: {actual[name][position]!r} != {value[position]!r}"
+            return f"{name} differs: {str(actual[name])[:200]} != {str(value)[:200]}"
+    return None
+
+def original_name(rng, title):
+    """An "Original Name" cell for title: the title, its last words, another name or blank"""
+    words = title.split()
+    kind = rng.random()
+    if kind < 0.3:
+        return title
+    if kind < 0.6 and words:
+        return " ".join(words[rng.randrange(len(words)):])
+    if kind < 0.8:
+        return f"{title} Returns"
+    return ""
+
+def with_original_names(values, rng):
+    """Return values with an "Original Name" column after the title"""
+    return [values[0][:1] + ["Original Name"] + values[0][1:]] + [
+        row[:1] + [original_name(rng, row[0])] + row[1:] for row in values[1:]
+    ]
+
+def random_row(rng, headers, values):
+    """A new row made of cells taken from random existing rows, some blank"""
+    donors = values[1:] or [headers]
+    row = []
+    for column in range(len(headers)):
+        donor = rng.choice(donors)
+        row.append(donor[column] if column < len(donor) and rng.random() >= 0.15 else "")
+    if "Original Name" in headers:
+        row[headers.index("Original Name")] = original_name(rng, row[0])
+    return row
+
+def edit(worksheet, rng):
+    """Apply one random edit, returning the 1-based row range it notifies, or None"""
+    values = worksheet.values
+    headers = values[0]
+    last = len(values)
+    kind = rng.choice(["edit", "edit", "edit", "blank", "append", "clear_end", "delete"])
+    if kind == "edit" and last > 1:
+        first = rng.randint(2, last)
+        end = min(last, first + rng.randint(0, 3))
+        for row in range(first, end + 1):
+            worksheet.update_row(row, random_row(rng, headers, values))
+        return first, end
+    if kind == "blank" and last > 1:
+        row = rng.randint(2, last)
+        worksheet.update_row(row, [""] * len(headers))
+        return row, row
+    if kind == "append":
+        # Sometimes leave a gap of blank rows before the new ones
+        first = last + 1 + (rng.randint(1, 2) if rng.random() < 0.2 else 0)
+        count = rng.randint(1, 3)
+        for row in range(first, first + count):
+            worksheet.update_row(row, random_row(rng, headers, values))
+        return rng.randint(2, first), first + count - 1
+    if kind == "clear_end" and last > 1:
+        first = max(2, last - rng.randint(0, 3))
+        for row in range(first, last + 1):
+            worksheet.update_row(row, [""] * len(headers))
+        return first, last + rng.randint(0, 2)
+    if kind == "delete" and last > 2:
+        # Deleting rows fires no onEdit, so no notification
+        first = rng.randint(2, last)
+        worksheet.delete_rows(first, min(last, first + rng.randint(0, 2)))
+    return None
+
+def check(rows, edits, seed, full_sync_ratio, original_names=False):
+    """Run the random edits, returning a description of the first mismatch or None"""
+    rng = random.Random(seed)
+    values = synthetic_values(rows, seed)
+    if original_names:
+        values = with_original_names(values, rng)
+    worksheet = FakeWorksheet(values)
+    bot.worksheet = worksheet
+    if not bot.load_snapshot():
+        return "the initial load failed"
+
+    for step in range(1, edits + 1):
+        notified = edit(worksheet, rng)
+        if notified is None and rng.random() < 0.5 and len(worksheet.values) > 1:
+            # An edit notified after an unnotified deletion must not hide
+            # the deletion from the next full sync
+            row = rng.randint(2, len(worksheet.values))
+            if not bot.sync_snapshot(row, row):
+                return f"step {step}: range sync {row}:{row} failed"
+
+        if notified is not None and rng.random() >= full_sync_ratio:
+            synced = bot.sync_snapshot(*notified)
+            how = f"range sync {notified[0]}:{notified[1]}"
+        else:
+            synced = bot.sync_snapshot()
+            how = "full sync"
+        if not synced:
+            return f"step {step}: {how} failed"
+
+        headers, columns = bot.columns_from_values(worksheet.get_all_values())
+        expected = snapshot_state(bot.SheetSnapshot(headers, columns, 0))
+        for source, current in (("snapshot", bot.snapshot), ("snapshot file", bot.load_snapshot_file())):
+            if current is None:
+                return f"step {step}: the {source} could not be loaded after a {how}"
+            difference = first_difference(snapshot_state(current), expected)
+            if difference:
+                return f"step {step}: after a {how}, the {source} {difference}"
+    return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=300, help="rows in the fake worksheet")
+    parser.add_argument("--edits", type=int, default=300, help="random edits to apply")
+    parser.add_argument("--seeds", type=int, default=5, help="runs with seeds 0..N-1")
+    parser.add_argument("--full-sync-ratio", type=float, default=0.2, help="share of notified edits followed by a full sync instead")
+    args = parser.parse_args(argv)
+
+    logging.getLogger(bot.__name__).setLevel(logging.WARNING)
+    failed = False
+    for seed in range(args.seeds):
+        for original_names in (False, True):
+            problem = check(args.rows, args.edits, seed, args.full_sync_ratio, original_names)
+            layout = " with original names" if original_names else ""
+            print(f"seed {seed}{layout}: {problem or 'ok'}", file=sys.stderr)
+            failed = failed or problem is not None
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""In-memory stand-ins for gspread's Spreadsheet and Worksheet
+
+They implement the subset of the gspread API the bot uses, so sheet sync and
+search can be exercised locally without a Google account. Every read is
+counted in ``calls`` and every edit moves the spreadsheet's modifiedTime.
+Reads can be made to fail like the real API does under quota pressure or
+outages, see ``FakeSpreadsheet.fail_next`` and ``failure_rate``.
+"""
+import json
+import random
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+
+import requests
+from gspread.exceptions import APIError
+from gspread.utils import numericise_all
+
+def api_error(status, retry_after=None):
+    """Return the APIError gspread raises for an HTTP error response"""
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({"error": {"code": status, "message": f"Injected HTTP {status}"}}).encode()
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
+    return APIError(response)
+
+class FakeSpreadsheet:
+    """Spreadsheet stand-in that tracks a Drive-style modifiedTime
+
+    Reads of the spreadsheet and its worksheets fail with the errors queued
+    by fail_next(), then at random with probability failure_rate (as a 503).
+    """
+
+    def __init__(self, failure_rate=0.0, seed=0):
+        self.calls = Counter()
+        self.failures = Counter()
+        self.failure_rate = failure_rate
+        self._pending_failures = deque()
+        self._rng = random.Random(seed)
+        self._modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def fail_next(self, *errors):
+        """Make the next reads raise these errors; ints become APIErrors with that status"""
+        self._pending_failures.extend(api_error(error) if isinstance(error, int) else error for error in errors)
+
+    def _read(self, calls, name):
+        calls[name] += 1
+        if self._pending_failures:
+            error = self._pending_failures.popleft()
+        elif self.failure_rate and self._rng.random() < self.failure_rate:
+            error = api_error(503)
+        else:
+            return
+        self.failures[name] += 1
+        raise error
+
+    def touch(self):
+        """Record an edit by moving modifiedTime forward"""
+        self._modified += timedelta(seconds=1)
+
+    def get_lastUpdateTime(self):
+        self._read(self.calls, "get_lastUpdateTime")
+        return self._modified.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+class FakeWorksheet:
+    """Worksheet stand-in holding its cells as a list of rows of strings"""
+
+    def __init__(self, values, spreadsheet=None):
+        self.values = [list(row) for row in values]
+        self.spreadsheet = spreadsheet or FakeSpreadsheet()
+        self.calls = Counter()
+
+    def _trimmed(self, rows):
+        # The Sheets API drops trailing empty cells and rows
+        rows = [list(row) for row in rows]
+        for row in rows:
+            while row and row[-1] == "":
+                row.pop()
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def get_all_values(self):
+        self.spreadsheet._read(self.calls, "get_all_values")
+        return self._trimmed(self.values)
+
+    def get_values(self, range_name=None):
+        """Return all values, or the rows of an A1 row range such as "5:9" """
+        self.spreadsheet._read(self.calls, "get_values")
+        if range_name is None:
+            return self._trimmed(self.values)
+        first, last = (int(part) for part in range_name.split(":"))
+        return self._trimmed(self.values[first - 1:last])
+
+    get = get_values
+
+    def row_values(self, row):
+        self.spreadsheet._read(self.calls, "row_values")
+        return self._trimmed(self.values[row - 1:row])[0] if row <= len(self.values) else []
+
+    def get_all_records(self):
+        self.spreadsheet._read(self.calls, "get_all_records")
+        values = self._trimmed(self.values)
+        if len(values) < 2:
+            return []
+        headers = values[0]
+        return [
+            dict(zip(headers, numericise_all(row + [""] * (len(headers) - len(row)))))
+            for row in values[1:]
+        ]
+
+    def update_row(self, row, values):
+        """Replace the cells of a 1-based row, growing the sheet if needed"""
+        while len(self.values) < row:
+            self.values.append([])
+        self.values[row - 1] = [str(value) for value in values]
+        self.spreadsheet.touch()
+
+    def append_row(self, values):
+        self.values.append([str(value) for value in values])
+        self.spreadsheet.touch()
+
+    def delete_rows(self, start_index, end_index=None):
+        """Delete the 1-based rows start_index..end_index inclusive"""
+        del self.values[start_index - 1:(end_index or start_index)]
+        self.spreadsheet.touch()
+
+CATALOGUE_HEADERS = ["Title", "Year", "Genre", "Language", "Quality", "Size", "Link", "Notes"]
+
+_TITLE_WORDS = [
+    "shadow", "king", "night", "river", "empire", "lost", "city", "dragon", "silent",
+    "storm", "last", "secret", "garden", "iron", "ocean", "star", "winter", "fire",
+    "hunter", "dream", "broken", "golden", "wild", "kingdom", "ghost", "legend",
+    "midnight", "crown", "blood", "echo", "frontier", "mirror", "paradise", "rebel",
+]
+_GENRES = ["Action", "Drama", "Comedy", "Thriller", "Sci-Fi", "Horror", "Romance", "Animation", "Documentary"]
+_LANGUAGES = ["Hindi", "English", "Tamil", "Telugu", "Korean", "Japanese", "Spanish"]
+_QUALITIES = ["480p", "720p", "1080p", "2160p 4K"]
+_NOTES = ["", "", "Dual audio", "ESubs", "Season pack", "Director's cut", "HDR10 WEB-DL"]
+
+def synthetic_values(rows, seed=0):
+    """Return header plus rows of catalogue-like cell values for benchmarking"""
+    rng = random.Random(seed)
+    values = [list(CATALOGUE_HEADERS)]
+    for row_id in range(rows):
+        title = " ".join(rng.choice(_TITLE_WORDS) for _ in range(rng.randint(1, 4))).title()
+        values.append([
+            title,
+            str(rng.randint(1960, 2024)),
+            rng.choice(_GENRES),
+            rng.choice(_LANGUAGES),
+            rng.choice(_QUALITIES),
+            f"{rng.uniform(0.3, 60):.1f} GB",
+            f"https://t.me/monktv/{100000 + row_id}",
+            rng.choice(_NOTES),
+        ])
+    return values
+
+def synthetic_worksheet(rows, seed=0):
+    """Return a FakeWorksheet filled with synthetic_values(rows, seed)"""
+    return FakeWorksheet(synthetic_values(rows, seed))
@@ -0,0 +1,406 @@
+"""End-to-end webhook load test against a stub Bot API and a fake worksheet
+
+Serves the bot's FastAPI app under uvicorn in a child process, with a
+synthetic FakeWorksheet and BOT_API_BASE_URL pointing at a stub Bot API
+server in this process, then POSTs synthetic Telegram updates to
+/telegram/webhook at a fixed rate. Each update's latency is measured from
+the POST to the stub receiving the bot's reply. Keeping the load generator
+out of the bot's process keeps its CPU use out of the measurements. The
+JSON report covers throughput, latency percentiles, error rates and the
+bot's event-loop lag, so configurations can be compared:
+
+    python loadtest.py --rate 200 --duration 30 --workers 8 --output load.json
+    python loadtest.py --rate 200 --env UPDATE_QUEUE_SIZE=100 --env SEARCH_MODE=ranked
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import asyncio
+import logging
+import platform
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from urllib.parse import parse_qs
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+LOADTEST_SCHEMA_VERSION = 3
+BOT_TOKEN = "123456:loadtest"
+
+def free_port():
+    """Return a TCP port on localhost nothing is listening on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def stub_message(chat_id, text, message_id):
+    return {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "text": text,
+    }
+
+def stub_bot_api(latency, replies, flood_limit=0, flood_waits=None):
+    """Return a Starlette app answering Bot API methods like Telegram would
+
+    Every method waits latency seconds first, to stand in for the round trip
+    to Telegram. The time each chat first receives a message is recorded in
+    replies. With a flood_limit, messages beyond that many in one second are
+    refused with a 429 and retry_after, counted in flood_waits["count"].
+    """
+    message_ids = iter(range(1, 1 << 62))
+    recent = deque()
+    webhook = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+
+    async def method(request):
+        body = await request.body()
+        if request.headers.get("content-type", "").startswith("application/json"):
+            params = json.loads(body or b"{}")
+        else:
+            params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        if latency:
+            await asyncio.sleep(latency)
+
+        name = request.path_params["method"]
+        if flood_limit and name in ("sendMessage", "editMessageText"):
+            now = time.monotonic()
+            while recent and recent[0] <= now - 1:
+                recent.popleft()
+            if len(recent) >= flood_limit:
+                flood_waits["count"] += 1
+                return JSONResponse({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                }, status_code=429)
+            recent.append(now)
+
+        if name == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Load", "username": "load_test_bot"}
+        elif name == "getWebhookInfo":
+            result = webhook
+        elif name == "setWebhook":
+            webhook["url"] = params.get("url", "")
+            result = True
+        elif name in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            replies.setdefault(chat_id, time.perf_counter())
+            result = stub_message(chat_id, params.get("text", ""), next(message_ids))
+        else:
+            result = True
+        return JSONResponse({"ok": True, "result": result})
+
+    return Starlette(routes=[Route("/bot{token}/{method}", method, methods=["GET", "POST"])])
+
+def message_update(update_id, text):
+    """Return a private-chat text message update; each update gets its own chat"""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": update_id, "type": "private", "first_name": "Load"},
+        "from": {"id": update_id, "is_bot": False, "first_name": "Load"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
+
+def make_updates(values, count, miss_ratio, command_ratio, rng):
+    """Build count synthetic updates searching for sheet titles, some missing"""
+    titles = [row[0] for row in values[1:]]
+    updates = []
+    for update_id in range(1, count + 1):
+        if rng.random() < miss_ratio:
+            query = "".join(rng.choice("qxzjvkw") for _ in range(rng.randint(4, 10)))
+        else:
+            words = rng.choice(titles).lower().split()
+            start = rng.randrange(len(words))
+            query = " ".join(words[start:start + rng.randint(1, 2)])
+        if rng.random() < command_ratio:
+            query = f"/search {query}"
+        updates.append(message_update(update_id, query))
+    return updates
+
+async def send_updates(url, updates, rate, connections, sent, acks, send_lag):
+    """POST updates to the webhook at a fixed rate without waiting for answers
+
+    send_lag collects how late each update was sent compared to its
+    schedule; when it grows the load generator, not the bot, is saturated.
+    """
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    # Requests beyond the connection count wait here rather than in
+    # httpx's pool, which slows down with many queued requests; the wait
+    # still counts towards their latency
+    slots = asyncio.Semaphore(connections)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+
+        async def post(update):
+            update_id = update["update_id"]
+            sent[update_id] = time.perf_counter()
+            async with slots:
+                try:
+                    response = await client.post("/telegram/webhook", json=update)
+                    acks[update_id] = (response.status_code, time.perf_counter() - sent[update_id])
+                except httpx.HTTPError as e:
+                    acks[update_id] = (type(e).__name__, time.perf_counter() - sent[update_id])
+
+        start = time.perf_counter()
+        tasks = []
+        for n, update in enumerate(updates):
+            delay = start + n / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            send_lag.append(max(0.0, -delay))
+            tasks.append(asyncio.create_task(post(update)))
+        await asyncio.gather(*tasks)
+
+async def monitor_loop_lag(samples, server, interval=0.01):
+    """Record (wall time, lag) of the event loop waking up late from interval-second sleeps once server is up"""
+    while not server.started:
+        await asyncio.sleep(interval)
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append((time.time(), time.perf_counter() - start - interval))
+
+def serve_in_thread(app, port):
+    """Run an ASGI app under uvicorn in a daemon thread, returning the server"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+def run_bot(port, env, rows, seed, results):
+    """Serve the bot in this (child) process
+
+    Sends the wall-clock time the bot started importing to results first,
+    so startup can be timed without the synthetic sheet's generation, and
+    the loop lag and update stats on exit.
+    """
+    os.environ.update(env)
+    from fake_sheets import FakeWorksheet, synthetic_values
+
+    values = synthetic_values(rows, seed)
+    results.send({"launched": time.time()})
+    import bot
+
+    logging.getLogger().setLevel(logging.WARNING)
+    bot.worksheet = FakeWorksheet(values)
+
+    async def serve():
+        # uvicorn exits cleanly, running the bot's shutdown, on SIGTERM
+        server = uvicorn.Server(uvicorn.Config(bot.app, host="127.0.0.1", port=port, log_level="warning"))
+        lag = []
+        lag_task = asyncio.create_task(monitor_loop_lag(lag, server))
+        await server.serve()
+        lag_task.cancel()
+        results.send({"loop_lag": lag, "update_stats": dict(bot.update_stats)})
+
+    asyncio.run(serve())
+
+def measure_startup(url, process, results, replies, timeout=300):
+    """Time the bot's cold start until it answers a first update and is ready
+
+    Returns seconds from the bot process starting to import the bot until
+    GET / answers (live), a probe update is answered (first_reply) and
+    GET /ready answers 200 (ready). The first reply may be the "still
+    loading" message when the snapshot is not loaded yet. Returns once the
+    bot reports its startup finished, so the snapshot file being written
+    right after the first load does not skew the load that follows.
+    """
+    if not results.poll(timeout):
+        raise RuntimeError("the bot process did not start")
+    # replies are perf_counter times; convert the child's wall clock to that
+    launched = results.recv()["launched"] - time.time() + time.perf_counter()
+    probe = message_update(0, "startup probe")
+    timings = {}
+    deadline = time.monotonic() + timeout
+    names = ("live_seconds", "first_reply_seconds", "ready_seconds")
+    settled = False
+    while not settled:
+        if time.monotonic() > deadline:
+            raise RuntimeError("the bot did not become ready in time")
+        if not process.is_alive():
+            raise RuntimeError("the bot process exited during startup")
+        try:
+            if "live_seconds" not in timings and httpx.get(url).status_code == 200:
+                timings["live_seconds"] = time.perf_counter() - launched
+            if "live_seconds" in timings and "first_reply_seconds" not in timings:
+                if 0 in replies:
+                    timings["first_reply_seconds"] = replies[0] - launched
+                elif "probe_acked" not in timings and httpx.post(f"{url}telegram/webhook", json=probe).status_code == 200:
+                    timings["probe_acked"] = True
+            if "ready_seconds" not in timings and httpx.get(f"{url}ready").status_code == 200:
+                timings["ready_seconds"] = time.perf_counter() - launched
+            if all(name in timings for name in names):
+                settled = httpx.get(url).json()["startup_seconds"] is not None
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.005)
+    return {name: round(timings[name], 3) for name in names}
+
+def latency_summary(durations, percentile):
+    """p50/p99/p999 and max of durations in milliseconds"""
+    durations = sorted(durations)
+    if not durations:
+        return None
+    return {
+        "count": len(durations),
+        "p50_ms": round(percentile(durations, 50) * 1000, 3),
+        "p99_ms": round(percentile(durations, 99) * 1000, 3),
+        "p999_ms": round(percentile(durations, 99.9) * 1000, 3),
+        "max_ms": round(durations[-1] * 1000, 3),
+    }
+
+def run(args, bot_env, updates, percentile):
+    """Serve the bot, drive load through it and return the results"""
+    replies = {}
+    flood_waits = {"count": 0}
+    stub_port = free_port()
+    stub = serve_in_thread(stub_bot_api(args.bot_api_latency, replies, args.bot_api_flood_limit, flood_waits), stub_port)
+    bot_env["BOT_API_BASE_URL"] = f"http://127.0.0.1:{stub_port}/bot"
+
+    port = free_port()
+    context = multiprocessing.get_context("spawn")
+    results, child_results = context.Pipe(duplex=False)
+    process = context.Process(target=run_bot, args=(port, bot_env, args.rows, args.seed, child_results))
+    process.start()
+    sent = {}
+    acks = {}
+    send_lag = []
+    try:
+        startup = measure_startup(f"http://127.0.0.1:{port}/", process, results, replies)
+
+        started = time.perf_counter()
+        load_started = time.time()
+        asyncio.run(send_updates(f"http://127.0.0.1:{port}", updates, args.rate, args.connections, sent, acks, send_lag))
+        accepted = [update_id for update_id, (status, _) in acks.items() if status == 200]
+        drain_until = time.perf_counter() + args.drain
+        while time.perf_counter() < drain_until and any(update_id not in replies for update_id in accepted):
+            time.sleep(0.05)
+        finished = max([started] + [replies[update_id] for update_id in accepted if update_id in replies])
+
+        process.terminate()
+        bot_results = results.recv() if results.poll(30) else {"loop_lag": [], "update_stats": None}
+    finally:
+        if process.is_alive():
+            process.kill()
+        process.join()
+        stub.should_exit = True
+
+    statuses = {}
+    for status, _ in acks.values():
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    answered = [update_id for update_id in accepted if update_id in replies]
+    elapsed = finished - started
+    acked = max([started] + [sent[update_id] + duration for update_id, (_, duration) in acks.items()]) - started
+    return {
+        "startup": startup,
+        "sent": len(updates),
+        "send_seconds": round(max(sent.values()) - started, 3) if sent else 0,
+        "statuses": statuses,
+        "answered": len(answered),
+        "unanswered": len(accepted) - len(answered),
+        "error_rate": round(1 - len(answered) / len(updates), 4) if updates else None,
+        "throughput_per_s": round(len(answered) / elapsed, 1) if elapsed > 0 else None,
+        "ack_throughput_per_s": round(len(acks) / acked, 1) if acked > 0 else None,
+        "ack_latency": latency_summary([duration for _, duration in acks.values()], percentile),
+        "reply_latency": latency_summary([replies[update_id] - sent[update_id] for update_id in answered], percentile),
+        # Only the lag under load, not while the bot was loading its snapshot
+        "loop_lag": latency_summary([lag for at, lag in bot_results["loop_lag"] if at >= load_started], percentile),
+        "send_lag": latency_summary(send_lag, percentile),
+        "flood_waits": flood_waits["count"],
+        "update_stats": bot_results["update_stats"],
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=100, help="updates per second to send")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to send updates for")
+    parser.add_argument("--drain", type=float, default=30, help="most seconds to wait for outstanding replies")
+    parser.add_argument("--rows", type=int, default=10000, help="rows in the synthetic worksheet")
+    parser.add_argument("--workers", type=int, help="UPDATE_WORKERS for the bot")
+    parser.add_argument("--queue-size", type=int, help="UPDATE_QUEUE_SIZE for the bot")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra bot environment variable")
+    parser.add_argument("--connections", type=int, default=100, help="load generator HTTP connections")
+    parser.add_argument("--bot-api-latency", type=float, default=0.02, help="seconds the stub Bot API takes per call")
+    parser.add_argument("--bot-api-flood-limit", type=int, default=0, help="messages per second the stub Bot API answers before replying 429 (0: unlimited)")
+    parser.add_argument("--miss-ratio", type=float, default=0.2, help="share of queries matching nothing")
+    parser.add_argument("--command-ratio", type=float, default=0.2, help="share of updates sent as /search commands")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    snapshot_dir = tempfile.mkdtemp(prefix="loadtest-")
+    bot_env = {
+        "BOT_TOKEN": BOT_TOKEN,
+        "WEBHOOK_URL": "http://127.0.0.1",
+        "GOOGLE_CREDS_JSON": "{}",
+        "SNAPSHOT_CACHE_PATH": os.path.join(snapshot_dir, "sheet_snapshot.db"),
+        # The stub has no flood limits unless --bot-api-flood-limit is given,
+        # so by default measure the bot rather than Telegram's global limit
+        "TELEGRAM_GLOBAL_RATE": "0",
+    }
+    if args.workers is not None:
+        bot_env["UPDATE_WORKERS"] = str(args.workers)
+    if args.queue_size is not None:
+        bot_env["UPDATE_QUEUE_SIZE"] = str(args.queue_size)
+    bot_env.update(item.split("=", 1) for item in args.env)
+
+    # The bot reads its configuration at import time; it is imported here
+    # only to report that configuration, the child process serves it
+    os.environ.update(bot_env)
+    import bot
+    from bench_search import percentile
+    from fake_sheets import synthetic_values
+
+    logging.getLogger().setLevel(logging.WARNING)
+    updates = make_updates(synthetic_values(args.rows, args.seed), int(args.rate * args.duration), args.miss_ratio, args.command_ratio, random.Random(args.seed))
+    print(f"sending {len(updates)} updates at {args.rate}/s...", file=sys.stderr)
+    results = run(args, bot_env, updates, percentile)
+
+    report = {
+        "schema": LOADTEST_SCHEMA_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "rate": args.rate,
+            "duration": args.duration,
+            "rows": args.rows,
+            "update_workers": bot.UPDATE_WORKERS,
+            "update_queue_size": bot.UPDATE_QUEUE_SIZE,
+            "search_mode": bot.SEARCH_MODE,
+            "connections": args.connections,
+            "bot_api_latency": args.bot_api_latency,
+            "bot_api_flood_limit": args.bot_api_flood_limit,
+            "miss_ratio": args.miss_ratio,
+            "command_ratio": args.command_ratio,
+            "seed": args.seed,
+            "env": {key: value for key, value in bot_env.items() if key not in ("BOT_TOKEN", "GOOGLE_CREDS_JSON")},
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()